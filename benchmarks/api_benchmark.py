@@ -0,0 +1,97 @@
+"""Throughput and latency of the Helix/OAuth2 layer against the local stand-in.
+
+Run from the repository root with `python -m benchmarks.api_benchmark [--requests 500] [--concurrency 20] [--latency 0.01]`
+Nothing here talks to Twitch, the stand-in from benchmarks/helix_standin.py is started in process.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import tempfile
+from time import perf_counter
+from typing import Awaitable, Callable, List
+from twitchcommandbot import http, PartialUser
+from .helix_standin import HelixStandIn
+
+class BenchmarkBot:
+    """Just enough of TwitchCommandBot for the http class"""
+    def __init__(self, loop: asyncio.AbstractEventLoop, auth: dict):
+        self.loop = loop
+        self.auth = auth
+        self.log = logging.getLogger("api_benchmark")
+
+def report(name: str, timings: List[float], elapsed: float, errors: int):
+    timings.sort()
+    p50 = statistics.median(timings) * 1000
+    p99 = timings[min(int(len(timings) * 0.99), len(timings) - 1)] * 1000
+    print(f"{name:<28} {len(timings):>6} ops {len(timings) / elapsed:>10.1f} ops/s   p50 {p50:>8.2f} ms   p99 {p99:>8.2f} ms   {errors} errors")
+
+async def measure(name: str, count: int, concurrency: int, op: Callable[[int], Awaitable]):
+    timings: List[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+    async def run(i: int):
+        async with semaphore:
+            start = perf_counter()
+            await op(i)
+            timings.append(perf_counter() - start)
+    start = perf_counter()
+    # Injected failures can outlast the single retry, those are counted rather than aborting the run
+    results = await asyncio.gather(*[run(i) for i in range(count)], return_exceptions=True)
+    report(name, timings, perf_counter() - start, sum(isinstance(r, Exception) for r in results))
+
+async def main(args):
+    standin = HelixStandIn(latency=args.latency, jitter=args.jitter, fail_401_rate=args.fail_401_rate, fail_429_rate=args.fail_429_rate,
+                            rate_limit=args.rate_limit)
+    await standin.start()
+    fd, config_path = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    auth = {
+        "twitch_client_id": "benchmark",
+        "twitch_client_secret": "benchmark",
+        "helix_base_url": standin.helix_base_url,
+        "oauth2_base_url": standin.oauth2_base_url
+    }
+    with open(config_path, "w") as f:
+        json.dump(auth, f)
+    api = http(BenchmarkBot(asyncio.get_running_loop(), auth), config_path)
+    n, c = args.requests, args.concurrency
+    try:
+        print(f"Stand-in latency {args.latency * 1000:.0f} ms (+{args.jitter * 1000:.0f} ms jitter), 401 rate {args.fail_401_rate}, 429 rate {args.fail_429_rate}")
+        await measure("token refresh", max(n // 10, 1), 1, lambda i: api.refresh_token())
+
+        # Every batch is a fresh set of ids so nothing is answered from the cache
+        await measure("get_users (100 ids, cold)", n, c, lambda i: api.get_users(user_ids=range(i * 100 + 1, i * 100 + 101)))
+        await measure("get_user (cold)", n, c, lambda i: api.get_user(user_id=10_000_000 + i))
+        await measure("get_user (cached)", n, c, lambda i: api.get_user(user_id=10_000_000 + i))
+
+        user = PartialUser(1, "user1", "User1")
+        def validate_cold(i: int):
+            api._validations.clear()
+            return api.validate_token(user, f"oauth:token-user1.{i}")
+        await measure("validate_token (cold)", n, c, validate_cold)
+        await measure("validate_token (cached)", n, c, lambda i: api.validate_token(user, "oauth:token-user1.0"))
+
+        print(f"Stand-in requests: {standin.requests}, injected 401s: {standin.injected_401}, injected 429s: {standin.injected_429}")
+        print(f"Rate limiter: {api.ratelimiter.stats}")
+        print(f"User cache: {api.user_cache.stats}")
+        print(f"Connection pool: {api.pool_stats}")
+    finally:
+        await api.close()
+        await standin.stop()
+        os.remove(config_path)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Helix/OAuth2 layer against a local stand-in")
+    parser.add_argument("--requests", type=int, default=500, help="Operations per benchmark")
+    parser.add_argument("--concurrency", type=int, default=20, help="Operations in flight at once")
+    parser.add_argument("--latency", type=float, default=0.005, help="Seconds the stand-in waits before answering")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--fail-401-rate", type=float, default=0.0)
+    parser.add_argument("--fail-429-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=int, default=100000, help="Stand-in Helix bucket size, lower it to benchmark the rate limiter")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
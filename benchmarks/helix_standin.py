@@ -0,0 +1,185 @@
+"""Local stand-in for the parts of Helix and the OAuth2 endpoints the bot talks to.
+
+Serves /helix/users, /oauth2/validate and /oauth2/token with made up but consistent data:
+user ids map to logins as `user<id>`, and user tokens are accepted as `token-<login>`, optionally followed by `.<anything>`.
+Latency, 401s, 429s and the Ratelimit-* headers can all be tuned.
+
+Run standalone with `python -m benchmarks.helix_standin [--port 8080] [--latency 0.02] ...`
+and point `helix_base_url`/`oauth2_base_url` in config.json at it.
+"""
+import argparse
+import asyncio
+import random
+from http import HTTPStatus
+from time import time
+from aiohttp import web
+from typing import Dict, Optional
+
+class HelixStandIn:
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, fail_401_rate: float = 0.0, fail_429_rate: float = 0.0,
+                rate_limit: int = 800, token_expires_in: int = 5000000, user_token_expires_in: int = 14400):
+        self.latency = latency
+        self.jitter = jitter
+        self.fail_401_rate = fail_401_rate
+        self.fail_429_rate = fail_429_rate
+        self.rate_limit = rate_limit
+        self.token_expires_in = token_expires_in
+        self.user_token_expires_in = user_token_expires_in
+        self.app_tokens = set()
+        self.remaining = rate_limit
+        self.reset_at = time() + 60
+        self.requests: Dict[str, int] = {"users": 0, "validate": 0, "token": 0}
+        self.injected_401 = 0
+        self.injected_429 = 0
+        self._issued = 0
+        self.app = web.Application()
+        self.app.add_routes([
+            web.get("/helix/users", self.users),
+            web.get("/oauth2/validate", self.validate),
+            web.post("/oauth2/token", self.token)
+        ])
+        self._runner: Optional[web.AppRunner] = None
+        self.port: Optional[int] = None
+
+    @property
+    def helix_base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/helix"
+
+    @property
+    def oauth2_base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/oauth2"
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0):
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def _delay(self):
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def _refill(self):
+        now = time()
+        if now >= self.reset_at:
+            self.remaining = self.rate_limit
+            self.reset_at = now + 60
+
+    def _ratelimit_headers(self) -> Dict[str, str]:
+        return {
+            "Ratelimit-Limit": str(self.rate_limit),
+            "Ratelimit-Remaining": str(self.remaining),
+            "Ratelimit-Reset": str(int(self.reset_at))
+        }
+
+    @staticmethod
+    def error(status: int, message: str, headers: Dict[str, str] = None) -> web.Response:
+        return web.json_response({"error": HTTPStatus(status).phrase, "status": status, "message": message}, status=status, headers=headers)
+
+    @staticmethod
+    def user_json(user_id: int) -> Dict:
+        return {
+            "id": str(user_id),
+            "login": f"user{user_id}",
+            "display_name": f"User{user_id}",
+            "type": "",
+            "broadcaster_type": "affiliate" if user_id % 3 else "",
+            "description": f"Description for user {user_id}",
+            "profile_image_url": f"https://static-cdn.jtvnw.net/jtv_user_pictures/{user_id}-profile_image-300x300.png",
+            "offline_image_url": "",
+            "view_count": user_id,
+            "created_at": "2016-12-14T20:32:28Z"
+        }
+
+    async def users(self, request: web.Request) -> web.Response:
+        self.requests["users"] += 1
+        await self._delay()
+        self._refill()
+        if self.remaining == 0:
+            return self.error(429, "Too Many Requests", self._ratelimit_headers())
+        if random.random() < self.fail_429_rate:
+            # Injected as a short throttle rather than draining the whole minute's bucket
+            self.injected_429 += 1
+            headers = self._ratelimit_headers()
+            headers.update({"Ratelimit-Remaining": "0", "Ratelimit-Reset": str(int(time()) + 1)})
+            return self.error(429, "Too Many Requests", headers)
+        self.remaining -= 1
+        headers = self._ratelimit_headers()
+        token = request.headers.get("Authorization", "").split(" ")[-1]
+        if token not in self.app_tokens or random.random() < self.fail_401_rate:
+            if token in self.app_tokens:
+                # Injected failures revoke the token so the client has to go through a real refresh
+                self.app_tokens.discard(token)
+                self.injected_401 += 1
+            return self.error(401, "Invalid OAuth token", headers)
+        ids = request.query.getall("id", [])
+        logins = request.query.getall("login", [])
+        if len(ids) + len(logins) > 100:
+            return self.error(400, "The parameter \"id\" and \"login\" combined exceeded the maximum allowed", headers)
+        found = {}
+        for user_id in ids:
+            if user_id.isdigit():
+                found[int(user_id)] = None
+        for login in logins:
+            if login.startswith("user") and login[4:].isdigit():
+                found[int(login[4:])] = None
+        return web.json_response({"data": [self.user_json(user_id) for user_id in found]}, headers=headers)
+
+    async def validate(self, request: web.Request) -> web.Response:
+        self.requests["validate"] += 1
+        await self._delay()
+        token = request.headers.get("Authorization", "").split(" ")[-1]
+        if not token.startswith("token-") or random.random() < self.fail_401_rate:
+            return self.error(401, "invalid access token")
+        login = token[6:].split(".")[0]
+        return web.json_response({
+            "client_id": "standin",
+            "login": login,
+            "scopes": ["chat:edit", "chat:read"],
+            "user_id": login[4:] if login[4:].isdigit() else "0",
+            "expires_in": self.user_token_expires_in
+        })
+
+    async def token(self, request: web.Request) -> web.Response:
+        self.requests["token"] += 1
+        await self._delay()
+        data = await request.post()
+        if data.get("grant_type") != "client_credentials" or not data.get("client_id") or not data.get("client_secret"):
+            return self.error(400, "invalid client")
+        self._issued += 1
+        token = f"app-{self._issued}"
+        self.app_tokens.add(token)
+        return web.json_response({"access_token": token, "expires_in": self.token_expires_in, "token_type": "bearer"})
+
+async def serve(args):
+    standin = HelixStandIn(latency=args.latency, jitter=args.jitter, fail_401_rate=args.fail_401_rate,
+                            fail_429_rate=args.fail_429_rate, rate_limit=args.rate_limit)
+    await standin.start(args.host, args.port)
+    print(f"Serving Helix on {standin.helix_base_url} and OAuth2 on {standin.oauth2_base_url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await standin.stop()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Local Helix/OAuth2 stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Up to this many extra seconds, picked at random")
+    parser.add_argument("--fail-401-rate", type=float, default=0.0, help="Fraction of requests rejected as unauthorized")
+    parser.add_argument("--fail-429-rate", type=float, default=0.0, help="Fraction of Helix requests rejected as rate limited")
+    parser.add_argument("--rate-limit", type=int, default=800, help="Helix bucket size per minute")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(serve(parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,70 @@
+"""Parsing throughput for recorded Twitch IRC traffic.
+
+Run from the repository root with `python -m benchmarks.irc_parser [repeats]`
+The recording in benchmarks/data/irc_traffic.txt is replayed in frames of a few lines each,
+the same way Twitch batches them over the websocket.
+"""
+import os
+import sys
+from time import perf_counter
+from typing import List
+from twitchcommandbot.irc_parser import parse_frame
+
+TRAFFIC = os.path.join(os.path.dirname(__file__), "data", "irc_traffic.txt")
+HANDLED = {"PING", "001", "JOIN", "PART"}
+
+def load_frames(lines_per_frame: int = 4) -> List[str]:
+    with open(TRAFFIC, newline="") as f:
+        lines = [line for line in f.read().split("\r\n") if line]
+    return ["".join(line + "\r\n" for line in lines[i:i + lines_per_frame]) for i in range(0, len(lines), lines_per_frame)]
+
+def legacy(frames: List[str]) -> int:
+    # What message_reciever used to do, one line per frame and repeated splits
+    handled = 0
+    for frame in frames:
+        stripped_message = frame.rstrip("\n")
+        if stripped_message.startswith("PING"):
+            handled += 1
+            continue
+        if stripped_message.split(' ')[1] == "001":
+            handled += 1
+        elif stripped_message.split(' ')[1] == "JOIN":
+            handled += 1
+        elif stripped_message.split(' ')[1] == "PART":
+            handled += 1
+    return handled
+
+def parsed(frames: List[str]) -> int:
+    handled = 0
+    for frame in frames:
+        for message in parse_frame(frame):
+            if message.command in HANDLED:
+                handled += 1
+    return handled
+
+def parsed_with_tags(frames: List[str]) -> int:
+    # Worst case where every tag is looked at
+    handled = 0
+    for frame in frames:
+        for message in parse_frame(frame):
+            handled += len(message.tags)
+    return handled
+
+def run(name: str, func, frames: List[str], lines: int, repeats: int):
+    start = perf_counter()
+    for _ in range(repeats):
+        handled = func(frames)
+    elapsed = perf_counter() - start
+    total = lines * repeats
+    print(f"{name:<18} {total / elapsed:>12,.0f} lines/s {elapsed / total * 1e6:>8.2f} us/line   {handled} handled per pass")
+
+def main(repeats: int = 2000):
+    frames = load_frames()
+    lines = sum(frame.count("\r\n") for frame in frames)
+    print(f"{lines} recorded lines in {len(frames)} frames, {repeats} passes")
+    run("legacy split", legacy, frames, lines, repeats) # Only looks at the first line of each frame
+    run("parse_frame", parsed, frames, lines, repeats)
+    run("parse_frame+tags", parsed_with_tags, frames, lines, repeats)
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
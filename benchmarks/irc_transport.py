@@ -0,0 +1,183 @@
+"""CPU per message and memory per connection for the websocket and TLS stream IRC transports.
+
+Run from the repository root with `python -m benchmarks.irc_transport [--messages 20000] [--connections 200]`
+A local server in a separate process speaks both, so only the client side is measured. It needs the openssl
+command line tool to make a throwaway certificate, pass --no-tls to compare without TLS instead.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import ssl
+import subprocess
+import tempfile
+import tracemalloc
+from time import perf_counter, process_time
+from typing import Callable, List, Optional, Tuple
+import websockets
+from twitchcommandbot.irc_parser import parse_frame, split_frame
+from twitchcommandbot.transport import StreamTransport, Transport, WebSocketTransport
+from .irc_parser import TRAFFIC
+
+LINES_PER_FRAME = 4 # Twitch batches a few lines into each websocket message
+
+def recorded_frames() -> List[str]:
+    with open(TRAFFIC, newline="") as f:
+        lines = [line for line in f.read().split("\r\n") if line]
+    return ["".join(line + "\r\n" for line in lines[i:i + LINES_PER_FRAME]) for i in range(0, len(lines), LINES_PER_FRAME)]
+
+def make_certificate(directory: str) -> Tuple[str, str]:
+    cert, key = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-keyout", key, "-out", cert,
+                    "-days", "1", "-subj", "/CN=localhost"], check=True, capture_output=True)
+    return cert, key
+
+async def handle(send: Callable, lines):
+    """FLOOD n streams n recorded lines back, SYNC answers DONE with how many lines arrived before it"""
+    frames = recorded_frames()
+    per_frame = [frame.count("\r\n") for frame in frames]
+    received = 0
+    async for line in lines:
+        if line.startswith("FLOOD "):
+            count = int(line.split(" ")[1])
+            i = 0
+            while count > 0:
+                await send(frames[i % len(frames)])
+                count -= per_frame[i % len(frames)]
+                i += 1
+        elif line == "SYNC":
+            await send(f"DONE {received}\r\n")
+            received = 0
+        else:
+            received += 1
+
+async def serve(cert: Optional[str], key: Optional[str], ports):
+    context = None
+    if cert:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert, key)
+
+    async def websocket_handler(ws, path=None):
+        async def lines():
+            async for message in ws:
+                for line in split_frame(message):
+                    yield line
+        await handle(ws.send, lines())
+
+    async def stream_handler(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        async def send(data: str):
+            writer.write(data.encode())
+            await writer.drain()
+        async def lines():
+            while True:
+                line = await reader.readline()
+                if not line:
+                    return
+                yield line.decode().rstrip("\r\n")
+        try:
+            await handle(send, lines())
+        except ConnectionError:
+            pass
+        writer.close()
+
+    # Lots of connections are opened at once for the memory figure
+    ws_server = await websockets.serve(websocket_handler, "127.0.0.1", 0, ssl=context, backlog=1024)
+    stream_server = await asyncio.start_server(stream_handler, "127.0.0.1", 0, ssl=context, backlog=1024)
+    ports.put((ws_server.sockets[0].getsockname()[1], stream_server.sockets[0].getsockname()[1]))
+    await asyncio.Future()
+
+def server_process(cert: Optional[str], key: Optional[str], ports):
+    asyncio.run(serve(cert, key, ports))
+
+async def flood(transport: Transport, count: int) -> int:
+    await transport.send(f"FLOOD {count}\r\n")
+    received = 0
+    while received < count:
+        for message in parse_frame(await transport.recv()):
+            received += 1
+    return received
+
+async def sync(transport: Transport) -> int:
+    await transport.send("SYNC\r\n")
+    while True:
+        for message in parse_frame(await transport.recv()):
+            if message.command == "DONE":
+                return int(message.params[0])
+
+async def measure(name: str, make: Callable[[], Transport], messages: int, connections: int):
+    transport = make()
+    await transport.connect()
+    await flood(transport, 100) # Warm up
+
+    cpu, wall = process_time(), perf_counter()
+    received = await flood(transport, messages)
+    recv_cpu, recv_wall = process_time() - cpu, perf_counter() - wall
+
+    cpu, wall = process_time(), perf_counter()
+    for i in range(messages):
+        await transport.send(f"PRIVMSG #channel :message number {i}\r\n")
+    sent = await sync(transport)
+    send_cpu, send_wall = process_time() - cpu, perf_counter() - wall
+    await transport.close()
+    if sent != messages:
+        print(f"{name}: server only saw {sent}/{messages} messages")
+
+    rss = rss_bytes()
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    opened = [make() for _ in range(connections)]
+    await asyncio.gather(*[t.connect() for t in opened])
+    heap = (tracemalloc.get_traced_memory()[0] - start) / connections
+    tracemalloc.stop()
+    rss_delta = (rss_bytes() - rss) / connections if rss else None
+    await asyncio.gather(*[t.close() for t in opened])
+
+    print(f"{name:<10} recv {recv_cpu / received * 1e6:>7.2f} us cpu/msg ({received / recv_wall:>9,.0f} msg/s)   "
+          f"send {send_cpu / messages * 1e6:>7.2f} us cpu/msg ({messages / send_wall:>9,.0f} msg/s)   "
+          f"{heap / 1024:>6.1f} KiB python heap/conn" + (f"   {rss_delta / 1024:>6.1f} KiB rss/conn" if rss_delta is not None else ""))
+
+def transport_factory(name: str, ws_port: int, stream_port: int, cert: Optional[str]) -> Callable[[], Transport]:
+    context = None
+    if cert:
+        context = ssl.create_default_context(cafile=cert)
+        context.check_hostname = False
+    if name == "websocket":
+        return lambda: WebSocketTransport(f"{'wss' if cert else 'ws'}://127.0.0.1:{ws_port}", ssl_context=context)
+    return lambda: StreamTransport("127.0.0.1", stream_port, tls=cert is not None, ssl_context=context)
+
+def measure_process(name: str, ws_port: int, stream_port: int, cert: Optional[str], messages: int, connections: int):
+    # A fresh process per transport, RSS never shrinks so whichever ran second would look cheaper
+    asyncio.run(measure(name, transport_factory(name, ws_port, stream_port, cert), messages, connections))
+
+def rss_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+def main(args):
+    with tempfile.TemporaryDirectory() as directory:
+        cert, key = (None, None) if args.no_tls else make_certificate(directory)
+        ports = multiprocessing.Queue()
+        server = multiprocessing.Process(target=server_process, args=(cert, key, ports), daemon=True)
+        server.start()
+        try:
+            ws_port, stream_port = ports.get(timeout=10)
+            print(f"{args.messages} messages each way, {args.connections} connections for memory, {'no TLS' if args.no_tls else 'TLS'}")
+            for name in ("websocket", "stream"):
+                client = multiprocessing.Process(target=measure_process, args=(name, ws_port, stream_port, cert, args.messages, args.connections))
+                client.start()
+                client.join()
+        finally:
+            server.terminate()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the websocket and TLS stream IRC transports")
+    parser.add_argument("--messages", type=int, default=20000, help="Messages received and sent per transport")
+    parser.add_argument("--connections", type=int, default=200, help="Connections opened at once for the memory figure")
+    parser.add_argument("--no-tls", action="store_true", help="Plain ws:// and TCP, no certificate needed")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    main(parse_args())
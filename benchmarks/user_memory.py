@@ -0,0 +1,64 @@
+"""Memory held by a cache full of Helix users, slotted User against the dict-backed model it replaced.
+
+Run from the repository root with `python -m benchmarks.user_memory [count]`
+"""
+import gc
+import json
+import sys
+import tracemalloc
+from typing import Callable
+from twitchcommandbot import User, UserCache
+from twitchcommandbot.utils import json_loads
+
+class DictUser:
+    """The User model from before __slots__, every field in the instance dict. Only the storage is kept,
+    the lazy properties only add to an instance once they're read and nothing here reads them"""
+    def __init__(self, id, login, display_name, type, broadcaster_type, description, profile_image_url, offline_image_url, view_count, created_at):
+        self.user_id: int = int(id)
+        self.id: int = int(id)
+        self.login: str = login
+        self.name: str = login
+        self.username: str = login
+        self.display_name: str = display_name
+        self._type = type
+        self._broadcaster_type = broadcaster_type
+        self._description = description
+        self._profile_image_url = profile_image_url
+        self._offline_image_url = offline_image_url
+        self._view_count = view_count
+        self._created_at = created_at
+
+def helix_payload(count: int) -> bytes:
+    return json.dumps({"data": [{
+        "id": str(100000 + i),
+        "login": f"user{i}",
+        "display_name": f"User{i}",
+        "type": "",
+        "broadcaster_type": "affiliate" if i % 3 else "",
+        "description": f"Description for user {i}",
+        "profile_image_url": f"https://static-cdn.jtvnw.net/jtv_user_pictures/{i}-profile_image-300x300.png",
+        "offline_image_url": "",
+        "view_count": i,
+        "created_at": "2016-12-14T20:32:28Z"
+    } for i in range(count)]}).encode()
+
+def measure(model: Callable, payload: bytes, count: int) -> int:
+    gc.collect()
+    tracemalloc.start()
+    cache = UserCache(max_size=count)
+    for user_json in json_loads(payload)["data"]:
+        cache.put(model(**user_json))
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{model.__name__:<9} {len(cache)} cached users: {current / 1024:.0f} KiB held, {current / len(cache):.0f} bytes per user, {peak / 1024:.0f} KiB peak")
+    return current
+
+def main(count: int = 10000):
+    payload = helix_payload(count)
+    before = measure(DictUser, payload, count)
+    after = measure(User, payload, count)
+    print(f"Slotted users save {(before - after) / count:.0f} bytes per user ({(before - after) / before:.0%})")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -2,15 +2,14 @@ from __future__ import annotations
 import disnake
 from disnake.ext import commands
 from aiohttp import ClientSession
-from time import time
+from time import time, monotonic
 import logging
 import json
 import sys
 import asyncio
 from twitchcommandbot.exceptions import TokenExpired
 from twitchcommandbot.subclasses import CustomConnectionState
-from twitchcommandbot import TwitchIRC, http, User, NotFound
-import aiofiles
+from twitchcommandbot import GuildIRCClient, IRCPool, http, User, NotFound, PermissionResolver, TokenBucket, create_storage
 from typing import TypeVar, Type, Any, Dict
 
 ACXT = TypeVar("ACXT", bound="disnake.ApplicationCommandInteraction")
@@ -44,14 +43,20 @@ class TwitchCommandBot(commands.InteractionBot):
         self.twitch_client_id = self.auth["twitch_client_id"]
         self.twitch_client_secret = self.auth["twitch_client_secret"]
         self.api = http(self, "config.json")
+        self.storage = create_storage(self.auth, self.loop)
+        self.permission_resolver = PermissionResolver(self)
         self._uptime = time()
         self.load_extension(f"twitchcommandbot.etc_commands")
         self.load_extension(f"twitchcommandbot.commands")
         self.load_extension(f"twitchcommandbot.exception_listener")
-        #self.load_extension(f"twitchcommandbot.client_cleanup")
+        self.load_extension(f"twitchcommandbot.client_cleanup")
         self.load_extension(f"twitchcommandbot.token_maintainer")
+        self.load_extension(f"twitchcommandbot.file_watcher")
 
-        self.irc_clients: Dict[disnake.Guild, Dict[str, TwitchIRC]] = {}
+        # One socket per twitch account, irc_clients holds each guild's view of it
+        self.irc_pool = IRCPool(self)
+        self.irc_clients: Dict[disnake.Guild, Dict[str, GuildIRCClient]] = {}
+        self.startup_stats: Dict[str, Any] = {}
         self.application_invoke = self.process_application_commands
         self.loop.create_task(self.robot_heartbeat())
 
@@ -61,13 +66,43 @@ class TwitchCommandBot(commands.InteractionBot):
             for client in list(d.values()):
                 if not client.closed:
                     await client.close()
-        if not self.aSession.closed:
-            await self.aSession.close()
+        await self.storage.close()
+        await self.api.close()
         await super().close()
 
+    @property
+    def stats(self) -> Dict[str, Dict]:
+        """Counters from the caches, rate limiters and connections, shown by /stats"""
+        connections = list(self.irc_pool.connections.values())
+        queues = [c.send_queue.stats for c in connections]
+        stats = {
+            **self.api.stats,
+            "permissions": self.permission_resolver.stats,
+            "irc_pool": self.irc_pool.stats,
+            "irc_connections": {
+                "reconnects": sum(c.reconnects for c in connections),
+                "failed_connects": sum(c.failed_connects for c in connections),
+                "queued": sum(q["depth"] for q in queues),
+                "sent": sum(q["sent"] for q in queues),
+                "failed": sum(q["failed"] for q in queues),
+                "delayed": sum(q["delayed"] for q in queues),
+                "max_wait_ms": max([q["max_wait_ms"] for q in queues], default=0.0)
+            },
+            **self.storage.stats
+        }
+        maintainer = self.get_cog("TokenMaintainer")
+        if maintainer is not None:
+            stats["token_sweep"] = maintainer.stats
+        if self.startup_stats:
+            stats["startup"] = self.startup_stats
+        return stats
+
+    @property
+    def aSession(self) -> ClientSession:
+        return self.api.session
+
     @commands.Cog.listener()
     async def on_connect(self):
-        self.aSession: ClientSession = ClientSession() #Make the aiohttp session asap
         await self.start_all_clients()
 
     @commands.Cog.listener()
@@ -90,47 +125,32 @@ class TwitchCommandBot(commands.InteractionBot):
     async def get_slash_context(self, interaction: disnake.Interaction, *, cls: Type[ACXT] = disnake.ApplicationCommandInteraction):
         return cls(data=interaction, state=self._connection)
 
-    async def get_irc_client(self, guild: disnake.Guild, user: User, create_new: bool = True) -> TwitchIRC:
+    async def get_irc_client(self, guild: disnake.Guild, user: User, create_new: bool = True) -> GuildIRCClient:
         # Attempt to fetch existing client for guild
-        if create_new and self.irc_clients.get(guild, None) is None:
-            self.irc_clients[guild] = {}
         client = self.irc_clients.get(guild, {}).get(user.username, None)
         # Create a new client if not found
         if not client and not create_new:
             raise NotFound
         elif client is None and create_new:
-            try:
-                async with aiofiles.open("connections.json") as f:
-                    connections = json.loads(await f.read())
-            except FileNotFoundError:
-                connections = {}
-            except json.decoder.JSONDecodeError:
-                connections = {}
-
-            data = connections.get(str(guild.id), {}).get(str(user.id), None)
+            data = await self.storage.get_client(guild.id, user.id)
             if data is None: # If it wasn't found, assume the user has not been setup
                 raise commands.UserNotFound("User has not been setup!")
             
             # Updated cached username if different
-            if user.username != connections[str(guild.id)][str(user.id)]["username"]:
-                connections[str(guild.id)][str(user.id)]["username"] = user.username
-                async with aiofiles.open("connections.json", "w") as f:
-                    await f.write(json.dumps(connections, indent=4))
+            if user.username != data["username"]:
+                self.api.user_cache.invalidate(login=data["username"])
+                await self.storage.update_client(guild.id, user.id, username=user.username)
 
-            token = connections[str(guild.id)][str(user.id)]["access_token"]
+            token = data["access_token"]
             if await self.api.validate_token(user, token, required_scopes=["chat:read", "chat:edit"]) == False:
                 raise TokenExpired(user, guild)
 
-            if connections[str(guild.id)][str(user.id)].get("expiry_notified", None):
-                del connections[str(guild.id)][str(user.id)]["expiry_notified"]
-                async with aiofiles.open("connections.json", "w") as f:
-                    await f.write(json.dumps(connections, indent=4))
+            if data["expiry_notified"]:
+                await self.storage.update_client(guild.id, user.id, expiry_notified=False)
 
-            channels = await self.api.get_users(user_ids=connections[str(guild.id)][str(user.id)]["joined_channels"])
-            # Create new client with provided data
-            client = TwitchIRC(self, guild, user, token, channels)
-            await client.connect()
-            self.irc_clients[guild][user.username] = client
+            channels = await self.api.get_users(user_ids=data["joined_channels"])
+            # Attach to the account's connection, opening one if no other guild has yet
+            client = await self.irc_pool.attach(guild, user, token, channels)
         return client
 
     async def robot_heartbeat(self):
@@ -138,52 +158,103 @@ class TwitchCommandBot(commands.InteractionBot):
         while not self.is_closed():
             if self.robot_heartbeat_url and self.robot_heartbeat_frequency > 0:
                 self.log.debug("Sending uptime heartbeat")
-                await self.aSession.get(self.robot_heartbeat_url)
+                async with self.aSession.get(self.robot_heartbeat_url):
+                    pass
             # Sleep for defined value
             await asyncio.sleep(self.robot_heartbeat_frequency*60)
 
     async def start_all_clients(self):
         self.log.info("Starting IRC Clients. This may take some time")
-        try:
-            async with aiofiles.open("connections.json") as f:
-                connections = json.loads(await f.read())
-        except FileNotFoundError:
-            connections = {}
-        except json.decoder.JSONDecodeError:
-            connections = {}
-        for guild_id, guild_data in connections.items():
-            guild = self.get_guild(int(guild_id))
-            if guild:
-                for user_id, user_data in guild_data.items():
-                    try:
-                        int(user_id)
-                    except ValueError:
-                        continue
-                    user = await self.api.get_user(user_id=user_id)
-                    try:
-                        await self.get_irc_client(guild, user)
-                        if user_data.get("expiry_notified", False):
-                            del connections[str(guild.id)][str(user.id)]["expiry_notified"]
-                            async with aiofiles.open("connections.json", "w") as f:
-                                await f.write(json.dumps(connections, indent=4))
-                    except TokenExpired:
-                        if not user_data.get("expiry_notified", False):
-                            expiry_channel = connections[str(guild.id)].get("expiry_channel", None)
-                            if expiry_channel:
-                                ex = self.get_channel(expiry_channel)
-                                try:
-                                    await ex.send(f"Token for client {user.username} has expired! Please update the token")
-                                except disnake.Forbidden:
-                                    pass
-                                except disnake.HTTPException:
-                                    pass
-                            connections[str(guild.id)][str(user.id)]["expiry_notified"] = True
-                            async with aiofiles.open("connections.json", "w") as f:
-                                await f.write(json.dumps(connections, indent=4))
-                        self.log.warning(f"{guild.name} ({user.username}): Not starting client due to expired token")
-                    await asyncio.sleep(0.5)
-        self.log.info("Finished starting IRC clients")
-    
+        started = monotonic()
+        timings: Dict[str, float] = {}
+        with self.api.background(): # Don't starve slash commands of Helix requests while starting up
+            # Resolve every account and joined channel in one go rather than a lookup per client
+            clients: Dict[disnake.Guild, Dict[int, Dict]] = {}
+            for guild_id, guild_clients in (await self.storage.get_all_clients()).items():
+                guild = self.get_guild(guild_id)
+                if guild:
+                    # Already running clients are left alone, on_connect fires again after a gateway reconnect
+                    clients[guild] = {user_id: data for user_id, data in guild_clients.items()
+                                      if data["username"] not in self.irc_clients.get(guild, {})}
+            ids = {user_id for guild_clients in clients.values() for user_id in guild_clients}
+            ids.update(c for guild_clients in clients.values() for data in guild_clients.values() for c in data["joined_channels"])
+            users = {user.id: user for user in await self.api.get_users(user_ids=list(ids))} if ids else {}
+            jobs = [(guild, users[user_id], data) for guild, guild_clients in clients.items()
+                    for user_id, data in guild_clients.items() if user_id in users]
+            stage = monotonic()
+            timings["resolve"] = stage - started
+
+            # Validations are cached per token, so guilds sharing an account only cost one request
+            valid = await asyncio.gather(*[self.api.validate_token(user, data["access_token"], required_scopes=["chat:read", "chat:edit"])
+                                           for guild, user, data in jobs], return_exceptions=True)
+            timings["validate"] = monotonic() - stage
+            stage = monotonic()
+
+            updates: Dict[tuple, Dict[str, Any]] = {}
+            expired = []
+            attaches = []
+            opened = set()
+            connect_bucket = TokenBucket(self.auth.get("irc_connect_limit", 10), self.auth.get("irc_connect_per", 1))
+            for (guild, user, data), token_valid in zip(jobs, valid):
+                fields = updates.setdefault((guild.id, user.id), {})
+                if user.username != data["username"]:
+                    self.api.user_cache.invalidate(login=data["username"])
+                    fields["username"] = user.username
+                if isinstance(token_valid, Exception):
+                    # Twitch couldn't be reached, connect anyway and the client keeps checking with backoff until it can
+                    self.log.warning(f"{guild.name} ({user.username}): Couldn't validate token ({token_valid!r}), connecting anyway")
+                elif token_valid == False:
+                    expired.append((guild, user, data))
+                    fields["expiry_notified"] = True
+                    continue
+                if data["expiry_notified"] and token_valid == True:
+                    fields["expiry_notified"] = False
+                channels = [users[c] for c in data["joined_channels"] if c in users]
+                # Only opening a new socket counts against the connect limit. Another guild attaching to it is free,
+                # and so is one left disconnected because the pool is full
+                if user.id not in opened and user.id not in self.irc_pool.connections and self.irc_pool.has_room():
+                    opened.add(user.id)
+                    await asyncio.sleep(connect_bucket.delay())
+                    connect_bucket.take()
+                attaches.append(self.loop.create_task(self.irc_pool.attach(guild, user, data["access_token"], channels)))
+            results = await asyncio.gather(*attaches, return_exceptions=True)
+            timings["connect"] = monotonic() - stage
+
+            for guild, user, data in expired:
+                if not data["expiry_notified"]:
+                    await self.notify_expired(guild, user)
+                self.log.warning(f"{guild.name} ({user.username}): Not starting client due to expired token")
+            failed = [r for r in results if isinstance(r, BaseException)]
+            for error in failed:
+                self.log.warning(f"Failed to start client: {error!r}")
+            # Clients removed, or given a new token, while this was running would get a stale partial record written back
+            current = await self.storage.get_all_clients()
+            tokens = {(guild.id, user.id): data["access_token"] for guild, user, data in jobs}
+            await self.storage.update_clients({key: fields for key, fields in updates.items()
+                                               if fields and current.get(key[0], {}).get(key[1], {}).get("access_token") == tokens[key]})
+        timings["total"] = monotonic() - started
+        self.startup_stats = {
+            "clients": len(jobs),
+            "started": len(results) - len(failed),
+            "expired": len(expired),
+            "failed": len(failed),
+            "connections": len(self.irc_pool.connections),
+            "timings": timings
+        }
+        self.log.info(f"Finished starting {len(results) - len(failed)}/{len(jobs)} IRC clients in {timings['total']:.2f}s "
+                      f"(resolve {timings['resolve']:.2f}s, validate {timings['validate']:.2f}s, connect {timings['connect']:.2f}s)")
+
+    async def notify_expired(self, guild: disnake.Guild, user: User):
+        expiry_channel = await self.storage.get_expiry_channel(guild.id)
+        if expiry_channel:
+            ex = self.get_channel(expiry_channel)
+            try:
+                await ex.send(f"Token for client {user.username} has expired! Please update the token")
+            except disnake.Forbidden:
+                pass
+            except disnake.HTTPException:
+                pass
+
 
 if __name__ == "__main__":
     bot = TwitchCommandBot()
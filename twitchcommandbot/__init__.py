@@ -1,6 +1,16 @@
 from .api import http
 from .asset import Avatar, OfflineImage
-from .enums import UserType, BroadcasterType
+from .enums import UserType, BroadcasterType, ConnectionState
 from .exceptions import BadAuthorization, BadRequest, NotFound, NotConnected, AlreadyConnected, NoPermissions, TokenExpired
+from .fanout import FanOut, ClientResult
 from .irc_client import TwitchIRC
-from .user import PartialUser, User
\ No newline at end of file
+from .irc_parser import IRCMessage, parse_message, parse_frame
+from .irc_pool import IRCPool, GuildIRCClient
+from .permissions import PermissionResolver
+from .ratelimit import HelixRateLimiter, RequestPriority
+from .send_queue import SendQueue, TokenBucket
+from .store import JSONStore
+from .storage import Storage, JSONStorage, SQLiteStorage, create_storage
+from .transport import Transport, TransportClosed, WebSocketTransport, StreamTransport, create_transport
+from .user import PartialUser, User
+from .user_cache import UserCache
\ No newline at end of file
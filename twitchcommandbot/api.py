@@ -1,63 +1,178 @@
 from __future__ import annotations
 from typing import TYPE_CHECKING
 import aiofiles
+import asyncio
 import json
+from time import time, monotonic
+from hashlib import sha256
 from disnake import HTTPException
-from aiohttp import ClientSession
+from aiohttp import ClientSession, TCPConnector
 from .user import PartialUser, User
+from .user_cache import UserCache
+from .ratelimit import HelixRateLimiter, background_priority
+from .utils import json_loads
 from .exceptions import BadAuthorization, BadRequest, NotFound
-from typing import Union, List, Dict
+from typing import Union, List, Dict, Optional, Tuple
 if TYPE_CHECKING:
     from main import TwitchCommandBot
 
 class http:
     def __init__(self, bot, auth_file):
         self.bot: TwitchCommandBot = bot
-        self.base = "https://api.twitch.tv/helix"
-        self.oauth2_base = "https://id.twitch.tv/oauth2"
         self.storage = auth_file
+        self.user_cache = UserCache()
+        self.ratelimiter = HelixRateLimiter(self.bot.loop)
+        self.reload_config(self.bot.auth)
+        self._chunk_semaphore = asyncio.Semaphore(self.bot.auth.get("helix_concurrency", 4))
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.coalesced = 0 # Lookups that piggybacked on a request already in flight
+        # App access token refreshes are single-flight, everyone waiting on an expired token shares one refresh
+        self._refresh_task: Optional[asyncio.Task] = None
+        self.token_refreshes = 0
+        self.max_retries = 3
+        self._validations: Dict[str, Tuple[float, Dict]] = {} # Token hash -> (expiry, /validate response)
+        self._validating: Dict[str, asyncio.Task] = {}
+        self.validation_margin = 60
+        self.validation_hits = 0
+        self.validation_misses = 0
+        # One pooled session for every outbound request, reused across gateway reconnects
+        self._session: Optional[ClientSession] = None
+        self.sessions_created = 0
+
+    def reload_config(self, auth: Dict):
+        # Overridable so the API layer can be pointed at a local stand-in, see benchmarks/helix_standin.py
+        self.base = auth.get("helix_base_url", "https://api.twitch.tv/helix").rstrip("/")
+        self.oauth2_base = auth.get("oauth2_base_url", "https://id.twitch.tv/oauth2").rstrip("/")
         try:
-            with open(auth_file) as f:
-                a = json.load(f)
-        except FileNotFoundError:
-            raise BadAuthorization
-        except json.decoder.JSONDecodeError:
-            raise BadAuthorization
-        try:
-            self.client_id = a["twitch_client_id"]
-            self.client_secret = a["twitch_client_secret"]
-            self.access_token = a.get("twitch_access_token", "")
+            self.client_id = auth["twitch_client_id"]
+            self.client_secret = auth["twitch_client_secret"]
+            # Older configs kept the app token under access_token
+            self.access_token = auth.get("twitch_access_token", auth.get("access_token", ""))
+            self.token_expires_at = auth.get("twitch_access_token_expires_at", None)
         except KeyError:
             raise BadAuthorization
-        self.bot.add_listener(self._make_session, 'on_connect')
+        # Tuning that applies straight away when config.json is edited. The pool size and helix_concurrency need a restart
+        self.user_cache.ttl = auth.get("user_cache_ttl", 300)
+        self.user_cache.max_size = auth.get("user_cache_size", 5000)
+        self.user_cache.negative_ttl = auth.get("user_cache_negative_ttl", 60)
+        self.token_refresh_margin = auth.get("token_refresh_margin", 3600)
+        self.ratelimiter.reserve = auth.get("helix_interactive_reserve", 10)
 
     @property
     def headers(self) -> Dict:
         return {"Authorization": f"Bearer {self.access_token}", "Client-Id": self.client_id}
 
-    async def _make_session(self):
-        self.session: ClientSession = ClientSession()
+    @property
+    def session(self) -> ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = ClientSession(connector=TCPConnector(
+                limit=self.bot.auth.get("http_pool_size", 100),
+                limit_per_host=self.bot.auth.get("http_pool_size_per_host", 30),
+                ttl_dns_cache=300,
+                keepalive_timeout=60,
+                enable_cleanup_closed=True
+            ))
+            self.sessions_created += 1
+        return self._session
 
-    async def _request(self, url, method="get", **kwargs):
-        response = await self.session.request(method=method, url=url, headers=self.headers, **kwargs)
-        if response.status == 401: #Refresh access token
-            reauth = await self.session.post(
-                url=f"{self.oauth2_base}/token", data={
-                    "client_id": self.client_id,
-                    "client_secret": self.client_secret,
-                    "grant_type": "client_credentials"
-            })
-            if reauth.status in [401, 400]:
-                reauth_data = await reauth.json()
-                raise BadAuthorization(reauth_data["message"])
+    @property
+    def stats(self) -> Dict[str, Dict]:
+        validations = self.validation_hits + self.validation_misses
+        return {
+            "helix_rate_limit": self.ratelimiter.stats,
+            "user_cache": self.user_cache.stats,
+            "token_validation": {
+                "cached": len(self._validations),
+                "hits": self.validation_hits,
+                "misses": self.validation_misses,
+                "hit_rate": self.validation_hits / validations if validations else 0.0
+            },
+            "http_session": self.pool_stats
+        }
+
+    @property
+    def pool_stats(self) -> Dict[str, int]:
+        if self._session is None or self._session.closed:
+            return {"sessions_created": self.sessions_created, "in_use": 0, "idle": 0}
+        connector = self._session.connector
+        return {
+            "sessions_created": self.sessions_created,
+            "limit": connector.limit,
+            "limit_per_host": connector.limit_per_host,
+            "in_use": len(getattr(connector, "_acquired", ())),
+            "idle": sum(len(conns) for conns in getattr(connector, "_conns", {}).values())
+        }
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def _refresh_token(self):
+        async with self.session.post(
+            url=f"{self.oauth2_base}/token", data={
+                "client_id": self.client_id,
+                "client_secret": self.client_secret,
+                "grant_type": "client_credentials"
+        }) as reauth:
             reauth_data = await reauth.json()
-            async with aiofiles.open(self.storage) as f:
-                self.bot.auth = json.loads(await f.read())
-            self.bot.auth["access_token"] = reauth_data["access_token"]
-            async with aiofiles.open(self.storage, "w") as f:
-                await f.write(json.dumps(self.bot.auth, indent=4))
-            self.access_token = reauth_data['access_token']
+        if reauth.status in [401, 400]:
+            raise BadAuthorization(reauth_data["message"])
+        self.access_token = reauth_data["access_token"]
+        self.token_expires_at = time() + reauth_data["expires_in"]
+        self.token_refreshes += 1
+        self.bot.auth.pop("access_token", None)
+        self.bot.auth["twitch_access_token"] = self.access_token
+        self.bot.auth["twitch_access_token_expires_at"] = self.token_expires_at
+        async with aiofiles.open(self.storage, "w") as f:
+            await f.write(json.dumps(self.bot.auth, indent=4))
+
+    async def refresh_token(self):
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = self.bot.loop.create_task(self._refresh_token())
+        # Shielded so one cancelled caller doesn't abort the refresh for everyone else
+        await asyncio.shield(self._refresh_task)
+
+    async def _ensure_token(self):
+        if not self.access_token or (self.token_expires_at is not None and time() >= self.token_expires_at):
+            await self.refresh_token()
+        elif self.token_expires_at is not None and time() >= self.token_expires_at - self.token_refresh_margin:
+            # Still valid, refresh in the background so nothing has to wait on it at expiry
+            if self._refresh_task is None or self._refresh_task.done():
+                self._refresh_task = self.bot.loop.create_task(self._refresh_token())
+                self._refresh_task.add_done_callback(self._log_refresh_error)
+
+    def _log_refresh_error(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            self.bot.log.warning(f"Background app access token refresh failed: {task.exception()}")
+
+    def background(self):
+        """Context manager marking the Helix requests made inside it as background work"""
+        return background_priority()
+
+    async def _send(self, url, method, **kwargs):
+        # 429s are retried once the bucket resets, the limiter holds the request until then
+        for attempt in range(self.max_retries + 1):
+            await self.ratelimiter.acquire()
             response = await self.session.request(method=method, url=url, headers=self.headers, **kwargs)
+            self.ratelimiter.update(response.headers)
+            if response.status != 429 or attempt == self.max_retries:
+                # Read the body now so the connection goes straight back to the pool, json() works off the buffered copy
+                try:
+                    await response.read()
+                finally:
+                    response.release()
+                return response
+            self.ratelimiter.throttle()
+            response.release()
+
+    async def _request(self, url, method="get", **kwargs):
+        await self._ensure_token()
+        token = self.access_token
+        response = await self._send(url, method, **kwargs)
+        if response.status == 401: #Refresh access token
+            if token == self.access_token: # Otherwise another request already refreshed it
+                await self.refresh_token()
+            response = await self._send(url, method, **kwargs)
         return response
 
     def chunks(self, lst, n):
@@ -65,52 +180,151 @@ class http:
         for i in range(0, len(lst), n):
             yield lst[i:i + n]
 
-    async def get_users(self, users: List[PartialUser] = [], user_ids: List[int] = [], user_logins: List[str] = []) -> List[User]:
-        queries = []
-        queries += [f"id={user.id}" for user in users]
-        queries += [f"id={id}" for id in user_ids]
-        queries += [f"login={login}" for login in user_logins]
-        users = []
-        for chunk in self.chunks(queries, 100):
-            join = '&'.join(chunk)
-            r = await self._request(f"{self.base}/users?{join}")
-            if r.status != 200:
-                rj = await r.json()
-                raise HTTPException(r, rj["message"])
-            json_data = (await r.json())["data"]
+    async def _fetch_chunk(self, chunk: List[str]):
+        try:
+            async with self._chunk_semaphore:
+                r = await self._request(f"{self.base}/users?{'&'.join(chunk)}")
+                if r.status != 200:
+                    rj = await r.json()
+                    raise HTTPException(r, rj["message"])
+                json_data = (await r.json(loads=json_loads))["data"]
+            found: Dict[str, User] = {}
             for user_json in json_data:
-                users += [User(**user_json)]
+                user = User(**user_json)
+                self.user_cache.put(user)
+                found[f"id={user.id}"] = user
+                found[f"login={user.login}"] = user
+            for query in chunk:
+                if query not in found and query.startswith("login="):
+                    self.user_cache.put_missing(query[6:])
+                self._inflight.pop(query).set_result(found.get(query, None))
+        except BaseException as e:
+            for query in chunk:
+                future = self._inflight.pop(query, None)
+                if future is None or future.done():
+                    continue
+                if isinstance(e, asyncio.CancelledError):
+                    future.cancel()
+                else:
+                    future.set_exception(e)
+
+    async def _resolve(self, queries: List[str]) -> Dict[str, Optional[User]]:
+        """Look up id=/login= queries, joining any identical lookups already in flight.
+        Chunks run in their own tasks so a cancelled caller can't take down lookups others are waiting on"""
+        waiting: Dict[str, asyncio.Future] = {}
+        to_fetch = []
+        for query in queries:
+            future = self._inflight.get(query, None)
+            if future is None:
+                future = self._inflight[query] = self.bot.loop.create_future()
+                to_fetch.append(query)
+            else:
+                self.coalesced += 1
+            waiting[query] = future
+        for chunk in self.chunks(to_fetch, 100):
+            self.bot.loop.create_task(self._fetch_chunk(chunk))
+        results = await asyncio.gather(*[asyncio.shield(f) for f in waiting.values()], return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return dict(zip(waiting.keys(), results))
+
+    async def get_users(self, users: List[PartialUser] = [], user_ids: List[int] = [], user_logins: List[str] = []) -> List[User]:
+        # Ids and logins in the order they were asked for, answering what we can from the cache
+        ordered: List[Union[int, str]] = list(dict.fromkeys([int(user.id) for user in users] + [int(id) for id in user_ids] + [login.lower() for login in user_logins]))
+        resolved: Dict[Union[int, str], User] = {}
+        queries = {}
+        for key in ordered:
+            if isinstance(key, int):
+                cached = self.user_cache.get_by_id(key)
+                query = f"id={key}"
+            elif self.user_cache.is_missing(key):
+                continue
+            else:
+                cached = self.user_cache.get_by_login(key)
+                query = f"login={key}"
+            if cached is None:
+                queries[query] = key
+            else:
+                resolved[key] = cached
+        if queries:
+            for query, user in (await self._resolve(list(queries.keys()))).items():
+                if user is not None:
+                    resolved[queries[query]] = user
+        users, seen = [], set()
+        for key in ordered:
+            user = resolved.get(key, None)
+            if user is not None and user.id not in seen:
+                seen.add(user.id)
+                users.append(user)
         return users
 
     async def get_user(self, user: PartialUser = None, user_id: int = None, user_login: str = None) -> Union[User, None]:
         if user is not None:
-            r = await self._request(f"{self.base}/users?id={user.id}")
-        elif user_id is not None:
-            r = await self._request(f"{self.base}/users?id={user_id}")
+            user_id = user.id
+        if user_id is not None:
+            cached = self.user_cache.get_by_id(user_id)
+            query = f"id={user_id}"
         elif user_login is not None:
-            r = await self._request(f"{self.base}/users?login={user_login}")
+            if self.user_cache.is_missing(user_login):
+                raise NotFound("User not found!")
+            cached = self.user_cache.get_by_login(user_login)
+            query = f"login={user_login.lower()}"
         else:
             raise BadRequest
-        j = await r.json()
-        if r.status != 200:
-            raise HTTPException(r, j["message"])
-        if j["data"] == []:
+        if cached is not None:
+            return cached
+        user = (await self._resolve([query]))[query]
+        if user is None:
             raise NotFound("User not found!")
-        json_data = j["data"][0]
-        return User(**json_data)
+        return user
+
+    @staticmethod
+    def _token_key(token: str) -> str:
+        # Only a hash of the token is kept around as the cache key
+        return sha256(token.split("oauth:")[-1].encode()).hexdigest()
+
+    def invalidate_token(self, token: str):
+        self._validations.pop(self._token_key(token), None)
+
+    async def _validate(self, key: str, token: str) -> Optional[Dict]:
+        async with self.session.get(f"{self.oauth2_base}/validate", headers={"Authorization": f"Bearer {token}"}) as r:
+            rj = json_loads(await r.read()) if r.status == 200 else None
+        if r.status == 200:
+            # Twitch wants tokens revalidated at least hourly, so never trust a result for longer than that
+            ttl = min(rj["expires_in"] - self.validation_margin, 3600) if rj.get("expires_in") else 3600
+            if ttl > 0:
+                self._validations[key] = (monotonic() + ttl, rj)
+            return rj
+        self._validations.pop(key, None)
+        if r.status == 401:
+            return None
+        raise BadRequest(f"Token validation failed with status {r.status}")
 
     async def validate_token(self, user: User, token: str, required_scopes: List[str] = None):
         stripped_token = token.split("oauth:")[-1]
-        r = await self.session.get(f"https://id.twitch.tv/oauth2/validate", headers={"Authorization": f"Bearer {stripped_token}"})
-        if r.status == 200:
-            rj = await r.json()
-            if rj["login"] != user.username:
+        key = self._token_key(stripped_token)
+        entry = self._validations.get(key, None)
+        if entry is not None and entry[0] > monotonic():
+            self.validation_hits += 1
+            rj = entry[1]
+        else:
+            self.validation_misses += 1
+            # Reconnecting clients sharing a token wait on a single validate request
+            task = self._validating.get(key, None)
+            if task is None:
+                task = self._validating[key] = self.bot.loop.create_task(self._validate(key, stripped_token))
+                task.add_done_callback(lambda t: self._validating.pop(key) if self._validating.get(key) is t else None)
+            try:
+                rj = await asyncio.shield(task)
+            except BadRequest:
+                return None
+            if rj is None:
                 return False
-            if required_scopes:
-                for scope in required_scopes:
-                    if scope not in rj["scopes"]:
-                        return False
-            return True
-        elif r.status == 401:
+        if rj["login"] != user.username:
             return False
-        return None
+        if required_scopes:
+            for scope in required_scopes:
+                if scope not in rj["scopes"]:
+                    return False
+        return True
@@ -1,11 +1,15 @@
 from disnake.ext import commands
-from re import findall
+from re import compile
+
+SIZE_PATTERN = compile(r"(image|(live_user.*))-(.*)(\.png|\.jpeg|\.jpg)")
 
 class Asset:
+    __slots__ = ("_url", "size", "url")
+    BASE = "https://static-cdn.jtvnw.net/"
+
     def __init__(self, avatar, size=None):
-        self.BASE = "https://static-cdn.jtvnw.net/"
         self._url = avatar
-        self.size: str = size or tuple(findall(r"(image|(live_user.*))-(.*)(\.png|\.jpeg|\.jpg)", self._url)[0][-2].split("x"))
+        self.size: str = size or tuple(SIZE_PATTERN.findall(self._url)[0][-2].split("x"))
         self.url: str = self._url.replace(f"{self.size[0]}x{self.size[1]}", "{width}x{height}")  
 
     def __str__(self) -> str:
@@ -14,10 +18,15 @@ class Asset:
     def __eq__(self, other):
         return isinstance(other, Asset) and self._url == other._url
 
+    def __hash__(self) -> int:
+        return hash(self._url)
+
     def __repr__(self) -> str:
         return f"<{type(self).__name__} {self._url.replace(self.BASE, '')}>"
 
 class Avatar(Asset):
+    __slots__ = ()
+
     def __init__(self, avatar, size=None):
         super().__init__(avatar, size)
 
@@ -31,6 +40,8 @@ class Avatar(Asset):
         return Avatar(self.url.format(width=size, height=size), size=size)
 
 class OfflineImage(Asset):
+    __slots__ = ()
+
     def __init__(self, avatar, size=None):
         super().__init__(avatar, size)
     
@@ -48,6 +59,8 @@ class OfflineImage(Asset):
         return OfflineImage(self.url.format(width=width, height=height), size=(width, height))
 
 class Thumbnail(OfflineImage):
+    __slots__ = ()
+
     def __init__(self, avatar, size=None):
         super().__init__(avatar, size)
 
@@ -1,27 +1,36 @@
 from disnake.ext import tasks, commands
 from time import time
 from typing import TYPE_CHECKING
+from .enums import ConnectionState
 if TYPE_CHECKING:
     from main import TwitchCommandBot
 
 class ClientCleanup(commands.Cog):
     def __init__(self, bot):
         self.bot: TwitchCommandBot = bot
+        self.idle_timeout = self.bot.auth.get("irc_idle_timeout", 3600)
         self.cleanup.start()
 
     def cog_unload(self):
         self.cleanup.cancel()
 
+    @commands.Cog.listener()
+    async def on_config_reload(self, auth: dict):
+        self.idle_timeout = auth.get("irc_idle_timeout", 3600)
+
     @tasks.loop(minutes=1)
     async def cleanup(self):
         await self.bot.wait_until_ready()
+        # Without a connection cap there's nothing to make room for, idle clients keep their sockets
+        if not self.idle_timeout or self.bot.irc_pool.max_connections is None:
+            return
         self.bot.log.debug("Running client cleanup")
-        for guild in list(self.bot.irc_clients.values()):
-            for client in list(guild.values()):
-                # If client inactive for more than 1 hour
-                if (client.last_activity + 3600) < time():
-                    self.bot.log.info(f"Closing client \"{client.user.username}\" in {client.guild} due to inactivity")
-                    await client.close()
+        pool = self.bot.irc_pool
+        for connection in list(pool.connections.values()):
+            # Only the socket goes, the client stays set up and reconnects the next time it's used
+            if connection.state is ConnectionState.ready and not pool.is_pinned(connection) and not connection.in_use and not len(connection.send_queue) \
+                    and (connection.last_activity + self.idle_timeout) < time():
+                await pool.evict(connection, "due to inactivity")
 
 def setup(bot):
-    bot.add_cog(ClientCleanup(bot))
\ No newline at end of file
+    bot.add_cog(ClientCleanup(bot))
@@ -1,10 +1,9 @@
 from disnake import Member, TextChannel
 from disnake.ext import commands
 from twitchcommandbot.exceptions import TokenExpired
+from twitchcommandbot.fanout import FanOut
 from twitchcommandbot.subclasses import ApplicationCustomContext
 from twitchcommandbot import NotFound, NotConnected, NoPermissions, User
-import aiofiles
-import json
 from typing import TYPE_CHECKING, List
 if TYPE_CHECKING:
     from main import TwitchCommandBot
@@ -16,75 +15,30 @@ class IRCCommands(commands.Cog):
 
     async def channel_autocomplete(ctx: ApplicationCustomContext, user_input: str):
         self = ctx.application_command.cog
-        try:
-            async with aiofiles.open("connections.json") as f:
-                connections = json.loads(await f.read())
-        except FileNotFoundError:
-            connections = {}
-        except json.decoder.JSONDecodeError:
-            connections = {}
-        usernames = [user.username for user in await self.bot.api.get_users(user_ids=[k for k in connections.get(str(ctx.guild.id), {}).keys() if k != "expiry_channel"])]
+        usernames = [user.username for user in await self.bot.api.get_users(user_ids=list((await self.bot.storage.get_clients(ctx.guild.id)).keys()))]
         return [channel for channel in usernames if channel.startswith(user_input)][:25]
 
     async def joined_channels_autocomplete(ctx: ApplicationCustomContext, user_input: str):
         self = ctx.application_command.cog
-        try:
-            async with aiofiles.open("connections.json") as f:
-                connections = json.loads(await f.read())
-        except FileNotFoundError:
-            connections = {}
-        except json.decoder.JSONDecodeError:
-            connections = {}
         user_obj = await self.bot.api.get_user(user_login=ctx.filled_options["user"])
         if user_obj is None:
             return ["No such channel with this name!"]
-        return [channel.username for channel in await self.bot.api.get_users(user_ids=connections[str(ctx.guild.id)][str(user_obj.id)]["joined_channels"]) if channel.username.startswith(user_input)][:25]
+        data = await self.bot.storage.get_client(ctx.guild.id, user_obj.id)
+        return [channel.username for channel in await self.bot.api.get_users(user_ids=data["joined_channels"]) if channel.username.startswith(user_input)][:25]
 
     async def group_autocomplete(ctx: ApplicationCustomContext, user_input: str):
         self = ctx.application_command.cog
-        try:
-            async with aiofiles.open("groups.json") as f:
-                groups = json.loads(await f.read())
-        except FileNotFoundError:
-            groups = {}
-        except json.decoder.JSONDecodeError:
-            groups = {}
-        return [group for group in groups.get(str(ctx.guild.id), {}).keys() if group.startswith(user_input)][:25]
+        return [group for group in (await self.bot.storage.get_groups(ctx.guild.id)).keys() if group.startswith(user_input)][:25]
 
     async def channel_group_autocomplete(ctx: ApplicationCustomContext, user_input: str):
         self = ctx.application_command.cog
-        try:
-            async with aiofiles.open("groups.json") as f:
-                groups = json.loads(await f.read())
-        except FileNotFoundError:
-            groups = {}
-        except json.decoder.JSONDecodeError:
-            groups = {}
         group_name = ctx.filled_options["group_name"]
-        usernames = [user.username for user in await self.bot.api.get_users(user_ids=groups.get(str(ctx.guild.id), {}).get(group_name, []))]
+        usernames = [user.username for user in await self.bot.api.get_users(user_ids=await self.bot.storage.get_group(ctx.guild.id, group_name) or [])]
         return [channel for channel in usernames if channel.startswith(user_input)][:25]
 
     def has_permissions():
         async def predicate(ctx: ApplicationCustomContext) -> bool:
-            try:
-                async with aiofiles.open("permissions.json") as f:
-                    permissions = json.loads(await f.read())
-            except FileNotFoundError:
-                permissions = {}
-            except json.decoder.JSONDecodeError:
-                permissions = {}
-            try:
-                async with aiofiles.open("config.json") as f:
-                    auth = json.loads(await f.read())
-            except FileNotFoundError:
-                auth = {}
-            except json.decoder.JSONDecodeError:
-                auth = {}
-            if ctx.author.guild_permissions.administrator:
-                return True
-            if ctx.author.id in permissions.get(str(ctx.guild.id), []):
-                return True
-            if ctx.author.id in auth.get("bot_owners", []):
+            if await ctx.bot.permission_resolver.check(ctx.author, ctx.guild):
                 return True
             raise NoPermissions
         return commands.check(predicate)
@@ -113,20 +67,7 @@ class IRCCommands(commands.Cog):
         if await self.bot.api.validate_token(user, oauth_token, required_scopes=["chat:read", "chat:edit"]) == False:
             return await ctx.send("Provided token is not valid, does not match the provided username, or does not contain the required scopes!", ephemeral=True)
 
-        try:
-            async with aiofiles.open("connections.json") as f:
-                connections = json.loads(await f.read())
-        except FileNotFoundError:
-            connections = {}
-        except json.decoder.JSONDecodeError:
-            connections = {}
-
-        if not connections.get(str(ctx.guild.id), None):
-            connections[str(ctx.guild.id)] = {}
-
-        connections[str(ctx.guild.id)][str(user.id)] = {"username": username, "access_token": oauth_token, "joined_channels": [user.id]}
-        async with aiofiles.open("connections.json", "w") as f:
-            await f.write(json.dumps(connections, indent=4))
+        await self.bot.storage.add_client(ctx.guild.id, user.id, username, oauth_token, [user.id])
         self.bot.loop.create_task(self.bot.get_irc_client(ctx.guild, user))
         self.bot.log.info(f"Added new client \"{username}\" to guild {ctx.guild}")
         await ctx.send("Client successfully added!", ephemeral=True)
@@ -148,22 +89,8 @@ class IRCCommands(commands.Cog):
         except TokenExpired:
             pass
 
-        try:
-            async with aiofiles.open("connections.json") as f:
-                connections = json.loads(await f.read())
-        except FileNotFoundError:
-            connections = {}
-        except json.decoder.JSONDecodeError:
-            connections = {}
-        try:
-            del connections[str(ctx.guild.id)][str(user.id)]
-        except KeyError:
+        if not await self.bot.storage.remove_client(ctx.guild.id, user.id):
             return await ctx.send("User not setup with bot!", ephemeral=True)
-        if connections[str(ctx.guild.id)] == {}:
-            del connections[str(ctx.guild.id)]
-
-        async with aiofiles.open("connections.json", "w") as f:
-            await f.write(json.dumps(connections, indent=4))
         self.bot.log.info(f"Deleted client \"{username}\" from guild {ctx.guild}")
         await ctx.send("Client successfully removed!")
 
@@ -174,15 +101,8 @@ class IRCCommands(commands.Cog):
         except NotFound:
             return await ctx.send("User does not exist!", ephemeral=True)
 
-        try:
-            async with aiofiles.open("connections.json") as f:
-                connections = json.loads(await f.read())
-        except FileNotFoundError:
-            connections = {}
-        except json.decoder.JSONDecodeError:
-            connections = {}
-
-        if str(user.id) not in connections[str(ctx.guild.id)].keys():
+        data = await self.bot.storage.get_client(ctx.guild.id, user.id)
+        if data is None:
             return await ctx.send("User not setup with bot!", ephemeral=True)
 
         if await self.bot.api.validate_token(user, oauth_token, required_scopes=["chat:read", "chat:edit"]) == False:
@@ -198,29 +118,19 @@ class IRCCommands(commands.Cog):
         except TokenExpired:
             pass
 
-        connections[str(ctx.guild.id)][str(user.id)]["access_token"] = oauth_token
-        if connections[str(ctx.guild.id)][str(user.id)].get("expiry_notified", None):
-            del connections[str(ctx.guild.id)][str(user.id)]["expiry_notified"]
-        async with aiofiles.open("connections.json", "w") as f:
-            await f.write(json.dumps(connections, indent=4))
+        self.bot.api.invalidate_token(data["access_token"])
+        await self.bot.storage.update_client(ctx.guild.id, user.id, access_token=oauth_token, expiry_notified=False)
         self.bot.loop.create_task(self.bot.get_irc_client(ctx.guild, user))
         self.bot.log.info(f"Updated client \"{username}\" in guild {ctx.guild}")
         await ctx.send("Client successfully updated!", ephemeral=True)
 
     @client.sub_command(name="list", description="List all setup clients in the server")
     async def client_list(self, ctx: ApplicationCustomContext):
-        try:
-            async with aiofiles.open("connections.json") as f:
-                connections = json.loads(await f.read())
-        except FileNotFoundError:
-            connections = {}
-        except json.decoder.JSONDecodeError:
-            connections = {}
-
-        if connections.get(str(ctx.guild.id), None) is None:
+        clients = await self.bot.storage.get_clients(ctx.guild.id)
+        if not clients:
             return await ctx.send("No clients have been setup in this server!")
 
-        users = await self.bot.api.get_users(user_ids=[u for u in connections[str(ctx.guild.id)].keys() if u != "expiry_channel"])
+        users = await self.bot.api.get_users(user_ids=list(clients.keys()))
         await ctx.send(f"There are currently {len(users)} client{'s' if len(users) != 1 else ''} setup in this server:\n**Clients:** {', '.join([user.username for user in users])}", ephemeral=True)
 
     # @commands.slash_command(description="Have a client join the provided twitch channel")
@@ -303,71 +213,32 @@ class IRCCommands(commands.Cog):
 
     @sendirc.sub_command(name="all", description="Send a command with all users setup in server")
     async def send_all(self, ctx: ApplicationCustomContext, command: str):
-        try:
-            async with aiofiles.open("connections.json") as f:
-                connections = json.loads(await f.read())
-        except FileNotFoundError:
-            connections = {}
-        except json.decoder.JSONDecodeError:
-            connections = {}
-        users = [u for u in await self.bot.api.get_users(user_ids=[k for k in connections.get(str(ctx.guild.id), {}).keys() if k != "expiry_channel"])]
-
-        c = 0
-        not_sent: List[User] = []
-        for user in users:
-            try:
-                client = await self.bot.get_irc_client(ctx.guild, user)
-                for channel in client.channels:
-                    await client.send(channel, command)
-            except TokenExpired:
-                not_sent.append(user)
-            except commands.UserNotFound:
-                not_sent.append(user)
-            except NotFound:
-                not_sent.append(user)
-            c += 1
-        self.bot.log.info(f"Sent message with all clients in {ctx.guild}")
-        if not_sent:
-            extra = f". Failed to sent message to {len(not_sent)} client{'s' if len(not_sent) != 1 else ''} ({', '.join([u.username for u in not_sent])})"
-        else:
-            extra = ""
-        await ctx.send(f"Sent message `{command}` to {c} channel{'s' if c != 1 else ''}{extra}")
+        users = [u for u in await self.bot.api.get_users(user_ids=list((await self.bot.storage.get_clients(ctx.guild.id)).keys()))]
+        fanout = await self.fan_out(ctx, users, command)
+        self.bot.log.info(f"Sent message with all clients in {ctx.guild} in {fanout.duration:.2f}s")
+        await self.fan_out_summary(ctx, fanout, f"Sent message `{command}` to {fanout.sent}/{fanout.channels} channel{'s' if fanout.channels != 1 else ''} in {fanout.duration:.1f}s")
 
     @sendirc.sub_command(name="group", description="Send a command in all channels in a specified group")
     async def send_group(self, ctx: ApplicationCustomContext, group_name: str = commands.Param(autocomplete=group_autocomplete), command: str = commands.Param()):
-        try:
-            async with aiofiles.open("groups.json") as f:
-                groups = json.loads(await f.read())
-        except FileNotFoundError:
-            groups = {}
-        except json.decoder.JSONDecodeError:
-            groups = {}
-        if groups.get(str(ctx.guild.id), None) == None:
-            raise commands.BadArgument("Group does not exist!")
-        if groups[str(ctx.guild.id)].get(group_name, None) == None:
+        group = await self.bot.storage.get_group(ctx.guild.id, group_name)
+        if group is None:
             raise commands.BadArgument("Group does not exist!")
 
-        users = await self.bot.api.get_users(user_ids=groups[str(ctx.guild.id)][group_name])
-        c = 0
-        not_sent: List[User] = []
-        for user in users:
-            try:
-                client = await self.bot.get_irc_client(ctx.guild, user)
-                for channel in client.channels:
-                    await client.send(channel, command)
-            except TokenExpired:
-                not_sent.append(user)
-            except commands.UserNotFound:
-                not_sent.append(user)
-            except NotFound:
-                not_sent.append(user)
-            c += 1
-        self.bot.log.info(f"Sent message to all clients in group {group_name} from {client.user.username} in guild {ctx.guild}")
-        if not_sent:
-            extra = f". Failed to sent message to {len(not_sent)} client{'s' if len(not_sent) != 1 else ''} ({', '.join([u.username for u in not_sent])})"
-        else:
-            extra = ""
-        await ctx.send(f"Sent message `{command}` to {c} channel{'s' if c != 1 else ''} in group \"{group_name}\"{extra}")
+        users = await self.bot.api.get_users(user_ids=group)
+        fanout = await self.fan_out(ctx, users, command)
+        self.bot.log.info(f"Sent message to all clients in group {group_name} in guild {ctx.guild} in {fanout.duration:.2f}s")
+        await self.fan_out_summary(ctx, fanout, f"Sent message `{command}` to {fanout.sent}/{fanout.channels} channel{'s' if fanout.channels != 1 else ''} in group \"{group_name}\" in {fanout.duration:.1f}s")
+
+    async def fan_out(self, ctx: ApplicationCustomContext, users: List[User], command: str) -> FanOut:
+        fanout = FanOut(self.bot, ctx.guild, users, command)
+        await fanout.run(lambda f: ctx.edit(content=f.progress_text()))
+        if fanout.failed:
+            self.bot.log.warning(f"Failed to send message with {', '.join([r.user.username for r in fanout.failed])} in {ctx.guild}")
+        return fanout
+
+    async def fan_out_summary(self, ctx: ApplicationCustomContext, fanout: FanOut, header: str):
+        # The command alone can be 500 characters, the summary gets whatever is left of discord's 2000
+        await ctx.edit(content=f"{header}\n{fanout.summary(limit=2000 - len(header) - 1)}")
 
     @sendirc.sub_command(name="channel", description="Send a message in a specific channel")
     #async def send_channel(self, ctx: ApplicationCustomContext, user: str = commands.Param(description="The authorized user", autocomplete=channel_autocomplete), channel: str = commands.Param(autocomplete=joined_channels_autocomplete), command: str = commands.Param()):
@@ -382,17 +253,8 @@ class IRCCommands(commands.Cog):
         try:
             await client.send(channel, command)
         except NotConnected:
-            try:
-                async with aiofiles.open("connections.json") as f:
-                    connections = json.loads(await f.read())
-            except FileNotFoundError:
-                connections = {}
-            except json.decoder.JSONDecodeError:
-                connections = {}
             await client.join(channel)
-            connections[str(ctx.guild.id)][str(client.user.id)]["joined_channels"].append(channel.id)
-            async with aiofiles.open("connections.json", "w") as f:
-                await f.write(json.dumps(connections, indent=4))
+            await self.bot.storage.add_joined_channel(ctx.guild.id, client.user.id, channel.id)
             await client.send(channel, command)
             await ctx.send(f"Joined and sent message to #{channel.name}")
         else:
@@ -406,94 +268,40 @@ class IRCCommands(commands.Cog):
 
     @group.sub_command(name="new", description="Create a new group")
     async def group_new(self, ctx: ApplicationCustomContext, group_name: str):
-        try:
-            async with aiofiles.open("groups.json") as f:
-                groups = json.loads(await f.read())
-        except FileNotFoundError:
-            groups = {}
-        except json.decoder.JSONDecodeError:
-            groups = {}
-        if groups.get(str(ctx.guild.id), None) == None:
-            groups[str(ctx.guild.id)] = {}
-        if groups[str(ctx.guild.id)].get(group_name, None) != None:
+        if not await self.bot.storage.create_group(ctx.guild.id, group_name):
             raise commands.BadArgument("Group name already exists!")
-        groups[str(ctx.guild.id)][group_name] = []
-        async with aiofiles.open("groups.json", "w") as f:
-            await f.write(json.dumps(groups, indent=4))
         await ctx.send(f"Created group \"{group_name}\"")
 
     @group.sub_command(name="delete", description="Delete an existing group")
     async def group_delete(self, ctx: ApplicationCustomContext, group_name: str = commands.Param(autocomplete=group_autocomplete)):
-        try:
-            async with aiofiles.open("groups.json") as f:
-                groups = json.loads(await f.read())
-        except FileNotFoundError:
-            groups = {}
-        except json.decoder.JSONDecodeError:
-            groups = {}
-        if groups[str(ctx.guild.id)].get(group_name, None) == None:
+        if not await self.bot.storage.delete_group(ctx.guild.id, group_name):
             raise commands.BadArgument(f"Group \"{group_name}\" does not exist!")
-        del groups[str(ctx.guild.id)][group_name]   
-        if groups[str(ctx.guild.id)] == {}:
-            del groups[str(ctx.guild.id)]
-        async with aiofiles.open("groups.json", "w") as f:
-            await f.write(json.dumps(groups, indent=4))
         await ctx.send(f"Deleted group \"{group_name}\"")
 
     @group.sub_command(name="add", description="Add client to group")
     async def group_add(self, ctx: ApplicationCustomContext, group_name: str = commands.Param(autocomplete=group_autocomplete), user: str = commands.Param(autocomplete=channel_autocomplete)):
-        try:
-            async with aiofiles.open("groups.json") as f:
-                groups = json.loads(await f.read())
-        except FileNotFoundError:
-            groups = {}
-        except json.decoder.JSONDecodeError:
-            groups = {}
-        if groups.get(str(ctx.guild.id), None) == None:
-            groups[str(ctx.guild.id)] = {}
-        if groups[str(ctx.guild.id)].get(group_name, None) == None:
+        if await self.bot.storage.get_group(ctx.guild.id, group_name) is None:
             raise commands.BadArgument(f"Group \"{group_name}\" does not exist!")
         user_obj = await self.bot.api.get_user(user_login=user)
-        groups[str(ctx.guild.id)][group_name].append(user_obj.id)
-        async with aiofiles.open("groups.json", "w") as f:
-            await f.write(json.dumps(groups, indent=4))
+        await self.bot.storage.add_group_member(ctx.guild.id, group_name, user_obj.id)
         await ctx.send(f"Added \"{user_obj.username}\" to group \"{group_name}\"")
 
     @group.sub_command(name="remove", description="Remove client from group")
     async def group_remove(self, ctx: ApplicationCustomContext, group_name: str = commands.Param(autocomplete=group_autocomplete), user: str = commands.Param(autocomplete=channel_group_autocomplete)):
-        try:
-            async with aiofiles.open("groups.json") as f:
-                groups = json.loads(await f.read())
-        except FileNotFoundError:
-            groups = {}
-        except json.decoder.JSONDecodeError:
-            groups = {}
-        if groups.get(str(ctx.guild.id), None) == None:
-            groups[str(ctx.guild.id)] = {}
-        if groups[str(ctx.guild.id)].get(group_name, None) == None:
+        if await self.bot.storage.get_group(ctx.guild.id, group_name) is None:
             raise commands.BadArgument(f"Group \"{group_name}\" does not exist!")
         user_obj = await self.bot.api.get_user(user_login=user)
-        if user_obj.id in groups[str(ctx.guild.id)][group_name]:
-            groups[str(ctx.guild.id)][group_name].remove(user_obj.id)
-        else:
+        if not await self.bot.storage.remove_group_member(ctx.guild.id, group_name, user_obj.id):
             raise commands.BadArgument(f"Client \"{user_obj.username}\" not in group \"{group_name}\"!")
-        async with aiofiles.open("groups.json", "w") as f:
-            await f.write(json.dumps(groups, indent=4))
         await ctx.send(f"Removed \"{user_obj.username}\" from group \"{group_name}\"")
 
     @group.sub_command(name="list", description="List clients that are part of provided group")
     async def group_list(self, ctx: ApplicationCustomContext, group_name: str = commands.Param(autocomplete=group_autocomplete)):
-        try:
-            async with aiofiles.open("groups.json") as f:
-                groups = json.loads(await f.read())
-        except FileNotFoundError:
-            groups = {}
-        except json.decoder.JSONDecodeError:
-            groups = {}
-        if groups[str(ctx.guild.id)].get(group_name, None) == None:
+        group = await self.bot.storage.get_group(ctx.guild.id, group_name)
+        if group is None:
             raise commands.BadArgument(f"Group \"{group_name}\" does not exist!")
-        channels = [c.username for c in await self.bot.api.get_users(user_ids=groups[str(ctx.guild.id)][group_name])]
-        await ctx.send(f"Group \"{group_name}\" has {len(groups[str(ctx.guild.id)][group_name])} client{'s' if len(groups[str(ctx.guild.id)][group_name]) != 1 else ''}\n**Clients:** {', '.join(channels)}")
+        channels = [c.username for c in await self.bot.api.get_users(user_ids=group)]
+        await ctx.send(f"Group \"{group_name}\" has {len(group)} client{'s' if len(group) != 1 else ''}\n**Clients:** {', '.join(channels)}")
 
     @commands.slash_command()
     @has_permissions()
@@ -502,37 +310,13 @@ class IRCCommands(commands.Cog):
 
     @tokenexpiry.sub_command(name="setchannel", description="Set a text channel that will alert of expired tokens")
     async def tokenexpiry_setchannel(self, ctx: ApplicationCustomContext, channel: TextChannel):
-        try:
-            async with aiofiles.open("connections.json") as f:
-                connections = json.loads(await f.read())
-        except FileNotFoundError:
-            connections = {}
-        except json.decoder.JSONDecodeError:
-            connections = {}
-        if connections.get(str(ctx.guild.id), None) is None:
-            connections[str(ctx.guild.id)] = {}
-        # This line is just to ensure the expiry channel key is always at the top
-        connections[str(ctx.guild.id)] = {"expiry_channel": channel.id, **connections[str(ctx.guild.id)]}
-        async with aiofiles.open("connections.json", "w") as f:
-            await f.write(json.dumps(connections, indent=4))
+        await self.bot.storage.set_expiry_channel(ctx.guild.id, channel.id)
         await ctx.send(f"Set token expiry alert channel to {channel.mention}")
 
     @tokenexpiry.sub_command(name="remove", description="Remove the set channel for token expiry alerts")
     async def tokenexpiry_remove(self, ctx: ApplicationCustomContext):
-        try:
-            async with aiofiles.open("connections.json") as f:
-                connections = json.loads(await f.read())
-        except FileNotFoundError:
-            connections = {}
-        except json.decoder.JSONDecodeError:
-            connections = {}
-        if not connections.get(str(ctx.guild.id), {}).get("expiry_channel", None):
+        if not await self.bot.storage.remove_expiry_channel(ctx.guild.id):
             return await ctx.send("Token expiry channel has not been set!")
-        del connections[str(ctx.guild.id)]["expiry_channel"]
-        if connections[str(ctx.guild.id)] == {}:
-            del connections[str(ctx.guild.id)]
-        async with aiofiles.open("connections.json", "w") as f:
-            await f.write(json.dumps(connections, indent=4))
         await ctx.send(f"Removed the set token expiry channel")
 
     @commands.slash_command()
@@ -542,75 +326,24 @@ class IRCCommands(commands.Cog):
 
     @permissions.sub_command(name="grant", description="Grant the provided user access to the bot in this server")
     async def permissions_grant(self, ctx: ApplicationCustomContext, user: Member):
-        try:
-            async with aiofiles.open("permissions.json") as f:
-                permissions = json.loads(await f.read())
-        except FileNotFoundError:
-            permissions = {}
-        except json.decoder.JSONDecodeError:
-            permissions = {}
-        try:
-            async with aiofiles.open("config.json") as f:
-                auth = json.loads(await f.read())
-        except FileNotFoundError:
-            auth = {}
-        except json.decoder.JSONDecodeError:
-            auth = {}
-        if user.id in auth.get("bot_owners", []) or user.id in permissions.get(str(ctx.guild.id), []):
+        if user.id in self.bot.permission_resolver.owners or not await self.bot.permission_resolver.grant(ctx.guild.id, user.id):
             return await ctx.send("User already has access to the bot")
-        if str(ctx.guild.id) not in permissions.keys():
-            permissions[str(ctx.guild.id)] = []
-        permissions[str(ctx.guild.id)].append(user.id)
-        async with aiofiles.open("permissions.json", "w") as f:
-            await f.write(json.dumps(permissions, indent=4))
         await ctx.send(f"Granted {user} access to the bot")
 
     @permissions.sub_command(name="revoke", description="Revoke the provided users access to the bot in this server")
     async def permissions_revoke(self, ctx: ApplicationCustomContext, user: Member):
-        try:
-            async with aiofiles.open("permissions.json") as f:
-                permissions = json.loads(await f.read())
-        except FileNotFoundError:
-            permissions = {}
-        except json.decoder.JSONDecodeError:
-            permissions = {}
-        try:
-            async with aiofiles.open("config.json") as f:
-                auth = json.loads(await f.read())
-        except FileNotFoundError:
-            auth = {}
-        except json.decoder.JSONDecodeError:
-            auth = {}
-        if user.id in auth.get("bot_owners", []):
+        if user.id in self.bot.permission_resolver.owners:
             return await ctx.send("Cannot revoke this users access to the bot")
-        if user.id not in permissions.get(str(ctx.guild.id), []):
+        if not await self.bot.permission_resolver.revoke(ctx.guild.id, user.id):
             return await ctx.send("User has not been granted access to the bot")
-        permissions[str(ctx.guild.id)].remove(user.id)
-        if permissions[str(ctx.guild.id)] == []:
-            del permissions[str(ctx.guild.id)]
-        async with aiofiles.open("permissions.json", "w") as f:
-            await f.write(json.dumps(permissions, indent=4))
         await ctx.send(f"Revoked {user}'s access to the bot")
 
     @permissions.sub_command(name="list", description="List all users with permissions to use the bot in this server")
     async def permissions_list(self, ctx: ApplicationCustomContext):
         await ctx.response.defer()
-        try:
-            async with aiofiles.open("permissions.json") as f:
-                permissions = json.loads(await f.read())
-        except FileNotFoundError:
-            permissions = {}
-        except json.decoder.JSONDecodeError:
-            permissions = {}
-        try:
-            async with aiofiles.open("config.json") as f:
-                auth = json.loads(await f.read())
-        except FileNotFoundError:
-            auth = {}
-        except json.decoder.JSONDecodeError:
-            auth = {}
-        users = [str(await self.bot.fetch_user(id)) for id in permissions.get(str(ctx.guild.id), [])]
-        users += [str(await self.bot.fetch_user(id)) for id in auth.get("bot_owners", []) if id not in permissions.get(str(ctx.guild.id), [])]
+        permissions = await self.bot.storage.get_permissions(ctx.guild.id)
+        users = [str(await self.bot.fetch_user(id)) for id in permissions]
+        users += [str(await self.bot.fetch_user(id)) for id in self.bot.permission_resolver.owners if id not in permissions]
         await ctx.send(f"{len(users)} user{'s' if len(users) != 1 else ''} {'have' if len(users) != 1 else 'has'} permissions to use the bot\n**Users:** {', '.join(users)}")
 
 def setup(bot):
@@ -10,3 +10,10 @@ class UserType(Enum):
     admin = "admin"
     global_mod = "global_mod"
     none = ""
+
+class ConnectionState(Enum):
+    disconnected = "disconnected"
+    connecting = "connecting"
+    ready = "ready"
+    reconnecting = "reconnecting"
+    closed = "closed"
@@ -213,5 +213,30 @@ class ETCCommands(commands.Cog):
             self.bot.reload_extension(ext_name)
         await ctx.send(f"Succesfully reloaded! Reloaded {cog_count} cogs!", ephemeral=True)
 
+    @staticmethod
+    def format_stat(value) -> str:
+        if isinstance(value, float):
+            return f"{value:.2f}"
+        if isinstance(value, dict):
+            return ", ".join(f"{k}: {ETCCommands.format_stat(v)}" for k, v in value.items())
+        return str(value)
+
+    @commands.slash_command(description="Owner Only: Show the bot's internal counters")
+    @commands.is_owner()
+    async def stats(self, ctx: ApplicationCustomContext):
+        lines = []
+        for section, values in self.bot.stats.items():
+            lines.append(f"{section}:")
+            lines += [f"  {key}: {self.format_stat(value)}" for key, value in values.items()]
+        # Split on lines so each message stays inside discord's limit
+        chunks = [""]
+        for line in lines:
+            line = line[:1900]
+            if len(chunks[-1]) + len(line) + 1 > 1900:
+                chunks.append("")
+            chunks[-1] += f"{line}\n"
+        for chunk in chunks:
+            await ctx.send(f"```yaml\n{chunk}```", ephemeral=True)
+
 def setup(bot):
     bot.add_cog(ETCCommands(bot))
\ No newline at end of file
@@ -3,8 +3,6 @@ from disnake.ext import commands
 from traceback import format_exception
 from twitchcommandbot.subclasses.custom_context import ApplicationCustomContext
 from twitchcommandbot.exceptions import NoPermissions, NotConnected, AlreadyConnected, NotFound, TokenExpired
-import aiofiles
-import json
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
     from main import TwitchCommandBot
@@ -17,18 +15,10 @@ class ErrorListener(commands.Cog):
     @commands.Cog.listener()
     async def on_slash_command_error(self, ctx: ApplicationCustomContext, exception):
         if isinstance(exception, TokenExpired):
-            try:
-                async with aiofiles.open("connections.json") as f:
-                    connections = json.loads(await f.read())
-            except FileNotFoundError:
-                connections = {}
-            except json.decoder.JSONDecodeError:
-                connections = {}
-            if not connections[str(exception.guild.id)][str(exception.user.id)].get("expiry_notified", False):
-                connections[str(exception.guild.id)][str(exception.user.id)]["expiry_notified"] = True
-                async with aiofiles.open("connections.json", "w") as f:
-                    await f.write(json.dumps(connections, indent=4))
-                expiry_channel = connections[str(exception.guild.id)].get("expiry_channel", None)
+            data = await self.bot.storage.get_client(exception.guild.id, exception.user.id)
+            if data is not None and not data["expiry_notified"]:
+                await self.bot.storage.update_client(exception.guild.id, exception.user.id, expiry_notified=True)
+                expiry_channel = await self.bot.storage.get_expiry_channel(exception.guild.id)
                 if expiry_channel:
                     ex = self.bot.get_channel(expiry_channel)
                     try:
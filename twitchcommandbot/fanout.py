@@ -0,0 +1,168 @@
+from __future__ import annotations
+import asyncio
+from disnake import Guild
+from disnake.ext import commands
+from .exceptions import NotConnected, NotFound, TokenExpired
+from .irc_pool import GuildIRCClient
+from .user import User
+from time import monotonic
+from typing import TYPE_CHECKING, Awaitable, Callable, Dict, List, Optional
+if TYPE_CHECKING:
+    from main import TwitchCommandBot
+
+class ClientResult:
+    """How one client's share of a fan out went"""
+    __slots__ = ("user", "channels", "sent", "error", "duration")
+
+    def __init__(self, user: User):
+        self.user = user
+        self.channels = 0
+        self.sent = 0
+        self.error: Optional[str] = None
+        self.duration = 0.0
+
+    @property
+    def failed(self) -> int:
+        return self.channels - self.sent
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.sent == self.channels
+
+    def __str__(self) -> str:
+        if self.error is not None:
+            return f"✗ {self.user.username}: {self.error}"
+        return f"{'✓' if self.ok else '✗'} {self.user.username}: {self.sent}/{self.channels} channel{'s' if self.channels != 1 else ''} in {self.duration:.1f}s"
+
+class FanOut:
+    """Sends one message with many clients at once. Up to `concurrency` clients are started and sending at a time,
+    and each one's messages still go through its own send queue so its rate limits hold"""
+    def __init__(self, bot, guild: Guild, users: List[User], message: str, concurrency: int = None):
+        self.bot: TwitchCommandBot = bot
+        self.guild = guild
+        self.users = users
+        self.message = message
+        self.concurrency = concurrency or self.bot.auth.get("sendirc_concurrency", 10)
+        self.timeout = self.bot.auth.get("sendirc_timeout", 120) # Seconds a client gets to connect, and to make progress sending after that
+        self.results: Dict[int, ClientResult] = {user.id: ClientResult(user) for user in users}
+        self.duration = 0.0
+        self._progress = asyncio.Event()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        return self.bot.loop
+
+    @property
+    def channels(self) -> int:
+        return sum(r.channels for r in self.results.values())
+
+    @property
+    def sent(self) -> int:
+        return sum(r.sent for r in self.results.values())
+
+    @property
+    def failed(self) -> List[ClientResult]:
+        return [r for r in self.results.values() if not r.ok]
+
+    @property
+    def done(self) -> int:
+        return sum(r.duration > 0 for r in self.results.values())
+
+    async def _send_with(self, semaphore: asyncio.Semaphore, result: ClientResult):
+        async with semaphore:
+            started = monotonic()
+            futures: List[asyncio.Future] = []
+            try:
+                # A client stuck reconnecting would otherwise hold its slot, and the whole fan out, forever
+                client = await asyncio.wait_for(self._connect(result), timeout=self.timeout)
+                if client is not None:
+                    await self._send(client, result, futures)
+            except TokenExpired:
+                result.error = "token expired"
+            except (commands.UserNotFound, NotFound):
+                result.error = "not set up"
+            except NotConnected as e:
+                result.error = str(e)
+            except asyncio.TimeoutError:
+                result.error = f"stalled after {result.sent}/{result.channels} channels" if result.channels else "timed out connecting"
+            except Exception as e:
+                self.bot.log.warning(f"Fan out with {result.user.username} failed: {e!r}")
+                result.error = f"failed ({type(e).__name__})"
+            finally:
+                # Whatever is still queued is dropped rather than sent after the summary says it wasn't
+                for future in futures:
+                    future.cancel()
+                result.duration = monotonic() - started
+                self._progress.set()
+
+    async def _connect(self, result: ClientResult) -> Optional[GuildIRCClient]:
+        client = await self.bot.get_irc_client(self.guild, result.user)
+        if not await client.connection.ensure_ready():
+            result.error = "connection closed"
+            return None
+        return client
+
+    async def _send(self, client: GuildIRCClient, result: ClientResult, futures: List[asyncio.Future]):
+        """Queue the message for every channel and wait for the queue to drain. The rate limit only paces this,
+        so there's no overall deadline, it only gives up once nothing has gone out for the timeout"""
+        channels = list(client.channels)
+        result.channels = len(channels)
+        # Send errors are already logged by the client, only count them here
+        def transmitted(future: asyncio.Future):
+            if not future.cancelled() and future.exception() is None:
+                result.sent += 1
+            self._progress.set()
+        for channel in channels:
+            future = await asyncio.wait_for(client.send(channel, self.message), timeout=self.timeout)
+            future.add_done_callback(transmitted)
+            futures.append(future)
+        pending = set(futures)
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=self.timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                raise asyncio.TimeoutError
+
+    async def run(self, progress: Callable[[FanOut], Awaitable] = None, interval: float = 1.0):
+        """Send with every client. progress is called at most every interval seconds while that's happening,
+        interaction edits are rate limited so there's no point doing it for every message"""
+        started = monotonic()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        task = asyncio.gather(*[self._send_with(semaphore, result) for result in self.results.values()])
+        try:
+            while not task.done():
+                self._progress.clear()
+                waiter = self.loop.create_task(self._progress.wait())
+                try:
+                    await asyncio.wait([task, waiter], return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    waiter.cancel()
+                self.duration = monotonic() - started
+                if progress is not None and not task.done():
+                    try:
+                        await progress(self)
+                    except Exception as e:
+                        self.bot.log.debug(f"Fan out progress update failed: {e}")
+                    await asyncio.wait([task], timeout=interval)
+            await task
+        finally:
+            task.cancel()
+        self.duration = monotonic() - started
+
+    def progress_text(self) -> str:
+        return f"Sending `{self.message}`... {self.done}/{len(self.results)} client{'s' if len(self.results) != 1 else ''} done, {self.sent}/{self.channels} channels sent ({self.duration:.1f}s)"
+
+    def summary(self, limit: int = 1800) -> str:
+        """One line per client, failures first, cut short to fit in a discord message"""
+        lines = []
+        length = 0
+        results = sorted(self.results.values(), key=lambda r: r.ok)
+        for i, result in enumerate(results):
+            line = str(result)
+            more = f"...and {len(results) - i - 1} more" if i < len(results) - 1 else ""
+            # Leave room for the "...and n more" line after this one
+            if length + len(line) + (len(more) + 1 if more else 0) > limit:
+                lines.append(f"...and {len(results) - i} more")
+                break
+            lines.append(line)
+            length += len(line) + 1
+        return "\n".join(lines)
@@ -0,0 +1,76 @@
+from disnake.ext import tasks, commands
+from twitchcommandbot.exceptions import BadAuthorization
+import json
+import os
+from typing import TYPE_CHECKING, Optional
+if TYPE_CHECKING:
+    from main import TwitchCommandBot
+
+class FileWatcher(commands.Cog):
+    def __init__(self, bot):
+        self.bot: TwitchCommandBot = bot
+        self.config_file = "config.json"
+        self.config_signature = self.signature(self.config_file)
+        self.config_reloads = 0
+        self.state_reloads = 0
+        self.watcher.change_interval(seconds=self.bot.auth.get("file_poll_interval", 5))
+        self.watcher.start()
+
+    def cog_unload(self):
+        self.watcher.cancel()
+
+    @staticmethod
+    def signature(path: str) -> Optional[tuple]:
+        # A changed inode catches editors that save by writing a new file and renaming it over the old one
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_ino, st.st_size)
+
+    def reload_config(self):
+        try:
+            with open(self.config_file) as f:
+                auth = json.load(f)
+        except FileNotFoundError:
+            return self.bot.log.warning(f"{self.config_file} is missing, keeping the current config")
+        except json.decoder.JSONDecodeError:
+            return self.bot.log.warning(f"{self.config_file} is not valid JSON, keeping the current config")
+        if auth == self.bot.auth: # Our own write, e.g. a refreshed app access token
+            return
+        try:
+            self.bot.api.reload_config(auth)
+        except BadAuthorization:
+            return self.bot.log.warning(f"{self.config_file} is missing twitch credentials, keeping the current config")
+        self.bot.auth = auth
+        self.bot.owner_ids = set(auth.get("bot_owners", []))
+        self.bot.robot_heartbeat_url = auth.get("uptime_heartbeat_url", None)
+        try:
+            self.bot.robot_heartbeat_frequency = int(auth.get("uptime_heartbeat_frequency_every_x_minutes", 0))
+        except ValueError:
+            self.bot.log.warning("Uptime heartbeat frequency is not a valid integer!")
+        self.bot.permission_resolver.reload_owners()
+        self.bot.irc_pool.reload_config(auth)
+        self.watcher.change_interval(seconds=auth.get("file_poll_interval", 5))
+        self.config_reloads += 1
+        self.bot.log.info(f"Reloaded {self.config_file}")
+        # Cogs with their own settings pick them up from this, see ClientCleanup and TokenMaintainer
+        self.bot.dispatch("config_reload", auth)
+
+    @tasks.loop(seconds=5)
+    async def watcher(self):
+        signature = self.signature(self.config_file)
+        if signature != self.config_signature:
+            self.config_signature = signature
+            self.reload_config()
+
+        changed = self.bot.storage.reload_changed()
+        if changed:
+            self.state_reloads += 1
+            if "permissions" in changed:
+                self.bot.permission_resolver.invalidate()
+            self.bot.log.info(f"Reloaded state from disk ({', '.join(changed)})")
+            self.bot.dispatch("state_reload", changed)
+
+def setup(bot):
+    bot.add_cog(FileWatcher(bot))
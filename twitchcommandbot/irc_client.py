@@ -1,196 +1,524 @@
 from disnake import Guild, Forbidden, HTTPException
 from disnake.ext import commands
-from websockets import client
-from websockets.exceptions import ConnectionClosed, ConnectionClosedError
+from .enums import ConnectionState
 from .exceptions import NotConnected, AlreadyConnected
+from .irc_parser import IRCMessage, parse_frame
+from .send_queue import SendQueue, TokenBucket
+from .transport import Transport, TransportClosed, create_transport
+import aiohttp
 import asyncio
-from time import time
+import random
+from contextlib import asynccontextmanager
+from time import time, monotonic
 from twitchcommandbot.user import User
-import json
-import aiofiles
-from typing import TYPE_CHECKING, List
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
 if TYPE_CHECKING:
     from main import TwitchCommandBot
 
+# NOTICE msg-ids Twitch answers a JOIN with instead of joining
+JOIN_FAILURES = {"msg_channel_suspended", "msg_banned", "tos_ban", "msg_room_not_found"}
+
 class TwitchIRC(commands.Cog):
-    __host = "wss://irc-ws.chat.twitch.tv"
-    __port = 443
+    """One IRC connection for a twitch account, shared by every guild that has the account set up.
+    Each attached guild keeps its own channel list, the socket joins all of them"""
+    max_line_length = 500
 
-    def __init__(self, bot, guild: Guild, user: User, oauth: str, connected_channels: List[User]):
+    def __init__(self, bot, user: User, oauth: str):
         self.bot: TwitchCommandBot = bot
         self.loop: asyncio.AbstractEventLoop = bot.loop
         self._ready = asyncio.Event()
-        self.__guild = guild
+        self._closed = asyncio.Event()
         self.__user = user
         self.__oauth = f"oauth:{oauth.split('oauth:')[-1]}"
-        self.__connected_channels = connected_channels
-        self.__tasks = []
+        self.__guilds: Dict[int, Guild] = {}
+        self.__guild_channels: Dict[int, List[User]] = {}
+        self.__joined: Set[str] = set() # Channels the socket is currently in
+        self.__socket: Optional[Transport] = None
+        self.__receivers: Dict[Transport, asyncio.Task] = {} # One per open socket, two while a reconnect is swapping them
+        self.__reconnect_task: Optional[asyncio.Task] = None
+        self.state = ConnectionState.disconnected
         self.last_activity = time()
+        self.send_queue = SendQueue(
+            self.loop, self._transmit,
+            normal_limit=self.bot.auth.get("irc_message_limit", 20),
+            moderator_limit=self.bot.auth.get("irc_moderator_message_limit", 100)
+        )
+        # IRC command -> handler, anything not in here is ignored
+        self._handlers = {
+            "PING": self.handle_ping,
+            "001": self.handle_welcome,
+            "JOIN": self.handle_join,
+            "PART": self.handle_part,
+            "USERSTATE": self.handle_userstate,
+            "NOTICE": self.handle_notice,
+            "RECONNECT": self.handle_reconnect
+        }
+        # Twitch allows 20 channel joins per 10 seconds, a comma separated JOIN counts every channel in it
+        self.join_bucket = TokenBucket(self.bot.auth.get("irc_join_limit", 20), 10)
+        self.join_timeout = 10
+        self.join_retries = 3
+        # Replies being waited on, keyed by (command, channel) and resolved straight from the receiver
+        self._pending: Dict[Tuple[str, Optional[str]], asyncio.Future] = {}
+        # The irc_connect/irc_join/irc_part bot events are only needed by outside listeners
+        self.dispatch_events = self.bot.auth.get("irc_dispatch_events", False)
+        self.rejected_joins: Set[str] = set() # Channels Twitch refused, retrying won't help
+        self.time_to_ready: Optional[float] = None
+        self.failed_joins: List[User] = []
+        # Connect attempts back off exponentially with full jitter, so a Twitch restart doesn't get every client back at once
+        self.backoff_base = self.bot.auth.get("irc_backoff_base", 1)
+        self.backoff_cap = self.bot.auth.get("irc_backoff_cap", 120)
+        self.connect_timeout = 10
+        self.reconnects = 0
+        self.reconnect_reasons: Dict[str, int] = {}
+        self.reconnect_time = 0.0
+        self.last_reconnect_duration: Optional[float] = None
+        self.failed_connects = 0
+        self.in_use = 0 # Joins, parts and sends in progress, the pool won't evict the connection out from under them
 
     @property
     def user(self) -> User:
         return self.__user
 
     @property
-    def guild(self) -> Guild:
-        return self.__guild
+    def guilds(self) -> List[Guild]:
+        return list(self.__guilds.values())
+
+    @property
+    def name(self) -> str:
+        return f"{', '.join([g.name for g in self.__guilds.values()])} ({self.__user.username})"
 
     @property
     def oauth(self) -> str:
         return self.__oauth
 
+    def update_token(self, oauth: str):
+        """Used on the next reconnect, a guild attaching with a newer token than the one we connected with"""
+        self.__oauth = f"oauth:{oauth.split('oauth:')[-1]}"
+
     @property
     def closed(self) -> bool:
-        return self.__socket.closed
+        # Only close() counts, a socket that dropped or was evicted from the pool comes back on its own
+        return self._closed.is_set()
 
     @property
     def channels(self) -> List[User]:
-        return self.__connected_channels
+        """Every channel any attached guild wants joined"""
+        return list(dict.fromkeys(c for channels in self.__guild_channels.values() for c in channels))
+
+    def guild_channels(self, guild: Guild) -> List[User]:
+        return self.__guild_channels.get(guild.id, [])
+
+    @property
+    def stats(self) -> Dict:
+        return {
+            "guilds": len(self.__guilds),
+            "channels": len(self.channels),
+            "joined": len(self.__joined),
+            "failed_joins": [c.username for c in self.failed_joins],
+            "time_to_ready": self.time_to_ready,
+            "state": self.state.value,
+            "reconnects": self.reconnects,
+            "reconnect_reasons": dict(self.reconnect_reasons),
+            "last_reconnect_duration": self.last_reconnect_duration,
+            "reconnect_time": self.reconnect_time,
+            "failed_connects": self.failed_connects,
+            "send_queue": self.send_queue.stats
+        }
 
     async def kill_tasks(self):
-        [task.cancel() for task in self.__tasks if task is not asyncio.tasks.current_task()]
+        current = asyncio.current_task()
+        for task in [*self.__receivers.values(), self.__reconnect_task]:
+            if task is not None and task is not current:
+                task.cancel()
+        self.__receivers.clear()
+        # Nothing will answer these on this socket
+        for future in self._pending.values():
+            future.cancel()
+        self._pending.clear()
+
+    def expect(self, command: str, channel: str = None) -> asyncio.Future:
+        """A future the receiver resolves when command arrives for channel. Everyone waiting on the same reply shares it"""
+        future = self._pending.get((command, channel), None)
+        if future is None or future.done():
+            future = self._pending[(command, channel)] = self.loop.create_future()
+        return future
+
+    def _resolve(self, command: str, channel: Optional[str], result=True):
+        future = self._pending.pop((command, channel), None)
+        if future is not None and not future.done():
+            future.set_result(result)
+
+    def _forget(self, command: str, channel: Optional[str], future: asyncio.Future):
+        if self._pending.get((command, channel), None) is future:
+            del self._pending[(command, channel)]
 
     async def wait_until_ready(self):
         await self._ready.wait()
 
-    async def message_reciever(self):
-        while not self.__socket.closed and not self.bot._closed:
-            try:
-                message = await self.__socket.recv()
-                stripped_message = message.rstrip("\n")
-                #self.bot.log.info(f"{self.__guild.name} ({self.__user.username}): {stripped_message}")
-                if stripped_message.startswith("PING"):
-                    self.bot.log.debug(f"{self.__guild.name} ({self.__user.username}): Pong")
-                    await self.__socket.send("PONG :tmi.twitch.tv\n")
-                    continue
-                
-                if stripped_message.split(' ')[1] == "001":
-                    self.bot.dispatch("irc_connect", self.user)
-                elif stripped_message.split(' ')[1] == "JOIN":
-                    self.bot.dispatch("irc_join", self.user, stripped_message.split(' ')[-1].lstrip("#"))
-                elif stripped_message.split(' ')[1] == "PART":
-                    self.bot.dispatch("irc_part", self.user, stripped_message.split(' ')[-1].lstrip("#"))
-            except ConnectionClosed:
-                await self.kill_tasks()
-                if self._ready.is_set():
-                    await self.connect()
-
-    async def join(self, channel: User):
-        def check(u, c):
-            return c == channel and u == self.user
-        await self.wait_until_ready()
+    async def ensure_ready(self) -> bool:
+        """Wait until the connection can be used, reconnecting it first if the pool evicted it.
+        Returns False if it was closed for good instead"""
         self.last_activity = time()
-        if channel not in self.__connected_channels:
-            await self.__socket.send(f"JOIN #{channel}\n")
-            await self.bot.wait_for("irc_join", check=check, timeout=8)
-            self.__connected_channels.append(channel)
-        else:
-            raise AlreadyConnected(channel)
-
-    async def part(self, channel: User):
-        def check(u, c):
-            return c == channel and u == self.user
-        await self.wait_until_ready()
-        self.last_activity = time()
-        if channel in self.__connected_channels:
-            await self.__socket.send(f"PART #{channel}\n")
-            await self.bot.wait_for("irc_part", check=check, timeout=8)
-            self.__connected_channels.remove(channel)
-        else:
+        while not self._closed.is_set():
+            if self.state is ConnectionState.disconnected:
+                await self.bot.irc_pool.wake(self)
+            # Not ready and not closed means it was evicted again before we got to use it
+            if await self.wait_until_ready_or_closed():
+                return True
+        return False
+
+    @asynccontextmanager
+    async def _using(self, channel: User):
+        self.in_use += 1
+        try:
+            if not await self.ensure_ready():
+                raise NotConnected(channel)
+            yield
+        finally:
+            self.in_use -= 1
+
+    async def wait_until_ready_or_closed(self) -> bool:
+        """Returns False if the connection was closed for good instead of becoming ready"""
+        waiters = [self.loop.create_task(self._ready.wait()), self.loop.create_task(self._closed.wait())]
+        try:
+            await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+        return self._ready.is_set()
+
+    def _start_receiver(self, socket: Transport):
+        self.__receivers[socket] = self.loop.create_task(self.message_reciever(socket))
+
+    async def _stop_receiver(self, socket: Transport):
+        task = self.__receivers.pop(socket, None)
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+        await socket.close()
+
+    async def message_reciever(self, socket: Transport):
+        try:
+            while not self.bot._closed:
+                frame = await socket.recv()
+                for message in parse_frame(frame):
+                    handler = self._handlers.get(message.command, None)
+                    if handler is not None:
+                        await handler(message, socket)
+        except TransportClosed:
+            pass
+        if self.__receivers.get(socket) is asyncio.current_task():
+            del self.__receivers[socket]
+        # A socket being replaced or still handshaking is expected to go away, only losing the live one needs a reconnect
+        if socket is self.__socket and not self._closed.is_set() and not self.bot._closed:
+            self._ready.clear()
+            self._schedule_reconnect("connection lost")
+
+    async def handle_ping(self, message: IRCMessage, socket: Transport):
+        self.bot.log.debug(f"{self.name}: Pong")
+        await socket.send(f"PONG :{message.trailing or 'tmi.twitch.tv'}\r\n")
+
+    async def handle_reconnect(self, message: IRCMessage, socket: Transport):
+        # Twitch is about to restart this server. The socket keeps working for a while, so resume on a new one first
+        if socket is self.__socket:
+            self._schedule_reconnect("RECONNECT")
+
+    async def handle_welcome(self, message: IRCMessage, socket: Transport):
+        self._resolve("001", None)
+        if self.dispatch_events:
+            self.bot.dispatch("irc_connect", self.user)
+
+    async def handle_join(self, message: IRCMessage, socket: Transport):
+        if message.nick == self.user.username:
+            self.__joined.add(message.channel)
+            self._resolve("JOIN", message.channel)
+            if self.dispatch_events:
+                self.bot.dispatch("irc_join", self.user, message.channel)
+
+    async def handle_part(self, message: IRCMessage, socket: Transport):
+        if message.nick == self.user.username:
+            self.__joined.discard(message.channel)
+            self._resolve("PART", message.channel)
+            if self.dispatch_events:
+                self.bot.dispatch("irc_part", self.user, message.channel)
+
+    async def handle_userstate(self, message: IRCMessage, socket: Transport):
+        # Sent on join and after every message, so this follows mod status being granted or taken away
+        tags = message.tags
+        moderator = tags.get("mod") == "1" or "broadcaster/" in tags.get("badges", "") or message.channel == self.user.username
+        self.send_queue.set_moderator(message.channel, moderator)
+
+    async def handle_notice(self, message: IRCMessage, socket: Transport):
+        if message.tags.get("msg-id") in JOIN_FAILURES and ("JOIN", message.channel) in self._pending:
+            self._resolve("JOIN", message.channel, False)
+            self.rejected_joins.add(message.channel)
+            self.bot.log.info(f"{self.name}: Could not join #{message.channel}: {message.trailing}")
+
+    async def join_channels(self, channels: List[User], socket: Transport = None) -> List[User]:
+        """Join channels in as few comma separated JOINs as the join rate limit allows. Returns the channels that weren't confirmed"""
+        socket = socket or self.__socket
+        futures: Dict[str, asyncio.Future] = {}
+        for channel in channels:
+            futures[channel.username] = self.expect("JOIN", channel.username)
+            self.rejected_joins.discard(channel.username)
+        try:
+            # Once the bucket runs dry, wait for a few tokens at a time so the rest still go out batched
+            refill_batch = max(self.join_bucket.capacity // 4, 1)
+            batch: List[str] = []
+            for i, channel in enumerate(channels):
+                delay = self.join_bucket.delay()
+                # Channel names are at most 25 characters, so the length check is on the safe side
+                if batch and (delay > 0 or (len(batch) + 1) * 27 > self.max_line_length):
+                    await socket.send(f"JOIN {','.join(batch)}\r\n")
+                    batch = []
+                if delay > 0:
+                    await asyncio.sleep(self.join_bucket.delay(min(refill_batch, len(channels) - i)))
+                self.join_bucket.take()
+                batch.append(f"#{channel.username}")
+            if batch:
+                await socket.send(f"JOIN {','.join(batch)}\r\n")
+            await asyncio.wait(futures.values(), timeout=self.join_timeout)
+        finally:
+            for name, future in futures.items():
+                self._forget("JOIN", name, future)
+        return [channel for channel in channels if not futures[channel.username].done() or futures[channel.username].cancelled()
+                or not futures[channel.username].result()]
+
+    async def attach(self, guild: Guild, channels: List[User]):
+        """Add a guild's channels to this connection, joining any the socket isn't already in"""
+        self.__guilds[guild.id] = guild
+        self.__guild_channels[guild.id] = list(channels)
+        if self._ready.is_set():
+            missing = [c for c in channels if c.username not in self.__joined]
+            if missing and await self.join_channels(missing):
+                self.bot.log.warning(f"{self.name}: Could not join every channel for {guild.name}")
+
+    async def detach(self, guild: Guild) -> int:
+        """Remove a guild, parting channels nobody else needs. Returns how many guilds are still attached"""
+        self.__guilds.pop(guild.id, None)
+        channels = self.__guild_channels.pop(guild.id, [])
+        if self.__guilds and self._ready.is_set():
+            still_needed = set(self.channels)
+            unused = [f"#{c.username}" for c in channels if c not in still_needed and c.username in self.__joined]
+            if unused:
+                await self.__socket.send(f"PART {','.join(unused)}\r\n")
+        return len(self.__guilds)
+
+    async def join(self, channel: User, guild: Guild):
+        async with self._using(channel):
+            channels = self.__guild_channels.setdefault(guild.id, [])
+            if channel in channels:
+                raise AlreadyConnected(channel)
+            # Another guild might already have the socket in this channel
+            if channel.username not in self.__joined and await self.join_channels([channel]):
+                raise asyncio.TimeoutError
+            channels.append(channel)
+
+    async def part(self, channel: User, guild: Guild):
+        channels = self.__guild_channels.get(guild.id, [])
+        if channel not in channels:
             raise NotConnected(channel)
+        if self.state is ConnectionState.disconnected: # Evicted, so there's nothing to part. No need to reconnect for it
+            channels.remove(channel)
+            return
+        async with self._using(channel):
+            if channel not in channels: # Parted by someone else while waiting
+                return
+            channels.remove(channel)
+            if channel in self.channels: # Still used by another guild
+                return
+            future = self.expect("PART", channel.username)
+            await self.__socket.send(f"PART #{channel.username}\r\n")
+            try:
+                await asyncio.wait_for(asyncio.shield(future), timeout=8)
+            finally:
+                self._forget("PART", channel.username, future)
 
-    async def send(self, channel: User, message: str):
-        await self.wait_until_ready()
-        self.last_activity = time()
-        if channel not in self.__connected_channels:
+    async def send(self, channel: User, message: str, wait: bool = False) -> asyncio.Future:
+        """Queue a message for channel. Returns once it's queued, or once it has been sent if wait is set.
+        The returned future resolves when the message is sent either way"""
+        if channel not in self.channels:
             raise NotConnected(channel)
-        await self.__socket.send(f"PRIVMSG #{channel.username} :{message}")
+        async with self._using(channel):
+            # Once queued, the pool leaves the connection alone until the queue is empty
+            future = self.send_queue.put(channel.username, f"PRIVMSG #{channel.username} :{message}\r\n")
+        future.add_done_callback(self._log_send_error)
+        if wait:
+            await future
+        return future
 
-    async def connect(self):
-        while not self.bot._closed:
-            if await self.bot.api.validate_token(self.user, self.__oauth, required_scopes=["chat:read", "chat:edit"]) == False:
-                self.bot.log.warning(f"{self.__guild.name} ({self.__user.username}): Token invalid, aborting connect")
-                await self.handle_revoked_token()
-                await self.close()
+    async def _transmit(self, line: str):
+        # Held back while reconnecting rather than written to a dead socket
+        while True:
+            await self.wait_until_ready()
+            socket = self.__socket
+            try:
+                await socket.send(line)
                 return
-            self._ready.clear()
-            failed_attempts = 0
-            while not self.bot._closed:  # Not sure if it works, but an attempt at a connecting backoff. Stolen from my modlogging script
-                self.__socket = await client.connect(f"{self.__host}:{self.__port}")
-                if self.__socket.closed:
-                    if 2**failed_attempts > 128:
-                        await asyncio.sleep(120)
-                    else:
-                        await asyncio.sleep(2**failed_attempts)
-                    failed_attempts += 1 # Continue to back off exponentially with every failed connection attempt up to 2 minutes
-                    self.bot.log.info(f"{self.__guild.name} ({self.__user.username}): {failed_attempts} failed attempts to connect.")
-                else:
+            except TransportClosed:
+                if socket is not self.__socket or self._closed.is_set():
+                    raise
+                # The receiver may not have noticed yet, wait for the reconnect instead of dropping the line
+                self._ready.clear()
+                self._schedule_reconnect("connection lost")
+
+    def _log_send_error(self, future: asyncio.Future):
+        if not future.cancelled() and future.exception() is not None:
+            self.bot.log.warning(f"{self.name}: Failed to send message: {future.exception()}")
+
+    async def connect(self):
+        started = monotonic()
+        self.state = ConnectionState.connecting
+        if await self._resume():
+            self.time_to_ready = monotonic() - started
+            self.bot.log.info(f"{self.name}: Joined channels ({', '.join([c.name for c in self.channels])}) in {self.time_to_ready:.2f}s")
+
+    def _schedule_reconnect(self, reason: str):
+        if self.__reconnect_task is not None and not self.__reconnect_task.done():
+            return
+        self.reconnect_reasons[reason] = self.reconnect_reasons.get(reason, 0) + 1
+        self.__reconnect_task = self.loop.create_task(self.reconnect(reason))
+
+    async def reconnect(self, reason: str = "requested"):
+        started = monotonic()
+        self.state = ConnectionState.reconnecting
+        self.bot.log.info(f"{self.name}: Reconnecting ({reason})")
+        if await self._resume():
+            self.reconnects += 1
+            self.last_reconnect_duration = monotonic() - started
+            self.reconnect_time += self.last_reconnect_duration
+            self.bot.log.info(f"{self.name}: Reconnected in {self.last_reconnect_duration:.2f}s")
+
+    async def _resume(self) -> bool:
+        """Bring up a new socket with every channel joined, then swap it in. Whatever was on the old socket keeps working
+        until the swap, so a RECONNECT from Twitch doesn't drop anything. Returns False if the connection was closed instead"""
+        if not await self._check_token():
+            return False
+        while True:
+            socket = await self._open_socket()
+            if socket is None:
+                return False
+            failed = self.channels
+            for attempt in range(self.join_retries):
+                if not failed or socket.closed:
                     break
-            await self.__socket.send(f"PASS {self.__oauth}\n")
-            await self.__socket.send(f"NICK {self.__user.username}\n")
-
-            self.__tasks = [
-                self.loop.create_task(self.message_reciever())
-            ]
-            def connect_check(u):
-                return u == self.user
+                if attempt > 0:
+                    self.bot.log.info(f"{self.name}: Failed to join {len(failed)} channel{'s' if len(failed) != 1 else ''}. Retrying...")
+                failed = [c for c in await self.join_channels(failed, socket) if c.username not in self.rejected_joins]
+            if self._closed.is_set():
+                await self._stop_receiver(socket)
+                return False
+            if not socket.closed:
+                break
+            self.bot.log.info(f"{self.name}: Lost the new connection while joining channels. Retrying...")
+            await self._stop_receiver(socket)
+        self.failed_joins = failed + [c for c in self.channels if c.username in self.rejected_joins]
+        if self.failed_joins:
+            self.bot.log.warning(f"{self.name}: Could not join {', '.join([c.name for c in self.failed_joins])}")
+        old, self.__socket = self.__socket, socket
+        self.__joined = {c.username for c in self.channels if c not in self.failed_joins}
+        self.state = ConnectionState.ready
+        self._ready.set()
+        if old is not None:
+            await self._stop_receiver(old)
+        return True
+
+    async def _check_token(self) -> bool:
+        """Validate the token before connecting, backing off while Twitch can't be reached.
+        Only an explicit rejection closes the connection, returns False if that happened or it was closed meanwhile"""
+        attempt = 0
+        while not self.bot._closed and not self._closed.is_set():
             try:
-                await self.bot.wait_for("irc_connect", check=connect_check, timeout=8)
-            except asyncio.TimeoutError:
-                self.bot.log.info(f"{self.__guild.name} ({self.__user.username}): Failed to connect. Retrying...")
-                await self.kill_tasks()
-                await self.__socket.close()
+                valid = await self.bot.api.validate_token(self.user, self.__oauth, required_scopes=["chat:read", "chat:edit"])
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                attempt += 1
+                delay = self._backoff_delay(attempt - 1)
+                self.bot.log.info(f"{self.name}: Couldn't validate token ({e!r}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
                 continue
-            self.bot.log.info(f"{self.__guild.name} ({self.__user.username}): Connected to websocket")
+            if valid == False:
+                self.bot.log.warning(f"{self.name}: Token invalid, aborting connect")
+                await self.handle_revoked_token()
+                await self.close()
+                return False
+            return True
+        return False
 
-            for channel in self.__connected_channels:
-                def check(u, c):
-                    return u == self.user, c == channel
-                while True:
-                    await self.__socket.send(f"JOIN #{channel.username}\n")
-                    try:
-                        await self.bot.wait_for("irc_join", check=check, timeout=8)
-                    except asyncio.TimeoutError:
-                        self.bot.log.info(f"{self.__guild.name} ({self.__user.username}): Failed to join channel. Retrying...")
-                    else:
-                        break
-                if len(self.__connected_channels) > 1:
-                    await asyncio.sleep(0.5)
-            break
-        self.bot.log.info(f"{self.__guild.name} ({self.__user.username}): Joined channels ({', '.join([c.name for c in self.__connected_channels])})")
-        self._ready.set()
-        # try:
-        #     await asyncio.wait(self.__tasks) # Tasks will run until the connection closes, we need to re-establish it if it closes
-        # except asyncio.exceptions.CancelledError:
-        #     pass
+    def _backoff_delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    async def _open_socket(self) -> Optional[Transport]:
+        """Connect and log in, backing off between failed attempts. Returns None if the connection is closed meanwhile"""
+        attempt = 0
+        while not self.bot._closed and not self._closed.is_set():
+            # irc_transport picks between the websocket and plain TLS, see transport.py
+            socket = create_transport(self.bot.auth)
+            try:
+                await asyncio.wait_for(socket.connect(), timeout=self.connect_timeout)
+                welcome = self.expect("001")
+                self._start_receiver(socket)
+                await socket.send("CAP REQ :twitch.tv/tags twitch.tv/commands\r\n") # Needed for USERSTATE
+                await socket.send(f"PASS {self.__oauth}\r\n")
+                await socket.send(f"NICK {self.__user.username}\r\n")
+                await asyncio.wait_for(asyncio.shield(welcome), timeout=8)
+                self.bot.log.info(f"{self.name}: Connected to chat")
+                return socket
+            except (OSError, asyncio.TimeoutError) as e: # TransportClosed and TLS errors included
+                error = e
+            except asyncio.CancelledError:
+                # The welcome future is cancelled when the connection is closed mid handshake
+                await self._stop_receiver(socket)
+                if self._closed.is_set():
+                    return None
+                raise
+            await self._stop_receiver(socket)
+            self.failed_connects += 1
+            delay = self._backoff_delay(attempt)
+            attempt += 1
+            self.bot.log.info(f"{self.name}: {attempt} failed attempt{'s' if attempt != 1 else ''} to connect ({error!r}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+        return None
+
+    async def disconnect(self):
+        """Close the socket but keep every guild and channel attached, ensure_ready connects again when it's next needed"""
+        self._ready.clear()
+        self.state = ConnectionState.disconnected
+        sockets = list(self.__receivers)
+        if self.__socket is not None and self.__socket not in sockets:
+            sockets.append(self.__socket)
+        self.__socket = None
+        self.__joined.clear()
+        await self.kill_tasks()
+        for socket in sockets:
+            await socket.close()
 
     async def handle_revoked_token(self):
-        try:
-            async with aiofiles.open("connections.json") as f:
-                connections = json.loads(await f.read())
-        except FileNotFoundError:
-            connections = {}
-        except json.decoder.JSONDecodeError:
-            connections = {}
-        if not connections[str(self.guild.id)][str(self.user.id)].get("expiry_notified", False):
-            connections[str(self.guild.id)][str(self.user.id)]["expiry_notified"] = True
-            async with aiofiles.open("connections.json", "w") as f:
-                await f.write(json.dumps(connections, indent=4))
-            expiry_channel = connections[str(self.guild.id)].get("expiry_channel", None)
-            if expiry_channel:
-                ex = self.bot.get_channel(expiry_channel)
-                try:
-                    await ex.send(f"Token for client {self.user.username} has expired! Please update the token")
-                except Forbidden:
-                    pass
-                except HTTPException:
-                    pass
-    
+        for guild in self.guilds:
+            data = await self.bot.storage.get_client(guild.id, self.user.id)
+            if data is not None and not data["expiry_notified"]:
+                await self.bot.storage.update_client(guild.id, self.user.id, expiry_notified=True)
+                expiry_channel = await self.bot.storage.get_expiry_channel(guild.id)
+                if expiry_channel:
+                    ex = self.bot.get_channel(expiry_channel)
+                    try:
+                        await ex.send(f"Token for client {self.user.username} has expired! Please update the token")
+                    except Forbidden:
+                        pass
+                    except HTTPException:
+                        pass
+
     async def close(self):
-        await self.wait_until_ready()
+        if self._closed.is_set():
+            return
         self._ready.clear()
-        del self.bot.irc_clients[self.__guild][self.__user.username]
-        if not self.__socket.closed:
-            self.bot.log.info(f"{self.__guild.name} ({self.__user.username}): Disconnecting from websocket")
-            await self.kill_tasks()
-            await self.__socket.close()
+        self._closed.set()
+        self.state = ConnectionState.closed
+        self.send_queue.close()
+        self.bot.irc_pool.remove(self)
+        sockets = list(self.__receivers)
+        await self.kill_tasks()
+        if self.__socket is not None and self.__socket not in sockets:
+            sockets.append(self.__socket)
+        if sockets:
+            self.bot.log.info(f"{self.name}: Disconnecting from chat")
+        for socket in sockets:
+            await socket.close()
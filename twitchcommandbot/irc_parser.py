@@ -0,0 +1,98 @@
+from typing import Dict, Iterator, List, Optional
+
+_MISSING = object()
+_TAG_ESCAPES = {":": ";", "s": " ", "\\": "\\", "r": "\r", "n": "\n"}
+
+def unescape_tag(value: str) -> str:
+    if "\\" not in value:
+        return value
+    out = []
+    i = 0
+    while i < len(value):
+        char = value[i]
+        if char == "\\":
+            i += 1
+            if i < len(value):
+                out.append(_TAG_ESCAPES.get(value[i], value[i]))
+        else:
+            out.append(char)
+        i += 1
+    return "".join(out)
+
+class IRCMessage:
+    """A single IRC line split into tags, prefix, command and params. Tags are only parsed when asked for"""
+    __slots__ = ("raw", "prefix", "command", "params", "_raw_tags", "_tags")
+
+    def __init__(self, raw: str, raw_tags: Optional[str], prefix: Optional[str], command: str, params: List[str]):
+        self.raw = raw
+        self.prefix = prefix
+        self.command = command
+        self.params = params
+        self._raw_tags = raw_tags
+        self._tags = _MISSING
+
+    @property
+    def tags(self) -> Dict[str, str]:
+        if self._tags is _MISSING:
+            self._tags = {}
+            if self._raw_tags:
+                for tag in self._raw_tags.split(";"):
+                    key, _, value = tag.partition("=")
+                    self._tags[key] = unescape_tag(value)
+        return self._tags
+
+    @property
+    def nick(self) -> Optional[str]:
+        # nick!user@host, or just a server name
+        if self.prefix is None:
+            return None
+        return self.prefix.split("!", 1)[0]
+
+    @property
+    def channel(self) -> Optional[str]:
+        if self.params and self.params[0].startswith("#"):
+            return self.params[0][1:]
+        return None
+
+    @property
+    def trailing(self) -> Optional[str]:
+        return self.params[-1] if self.params else None
+
+    def __repr__(self) -> str:
+        return f"<IRCMessage command={self.command!r} prefix={self.prefix!r} params={self.params!r}>"
+
+def parse_message(line: str) -> Optional[IRCMessage]:
+    """Parse one line without its line ending. Returns None for blank or malformed lines"""
+    raw_tags = None
+    prefix = None
+    rest = line
+    # partition keeps this to a handful of C level scans instead of a full split per message
+    if rest.startswith("@"):
+        raw_tags, _, rest = rest[1:].partition(" ")
+        rest = rest.lstrip(" ")
+    if rest.startswith(":"):
+        prefix, _, rest = rest[1:].partition(" ")
+        rest = rest.lstrip(" ")
+    command, _, rest = rest.partition(" ")
+    if not command:
+        return None
+    if not rest:
+        params = []
+    elif rest.startswith(":"):
+        params = [rest[1:]]
+    else:
+        middle, separator, trailing = rest.partition(" :")
+        params = middle.split()
+        if separator:
+            params.append(trailing)
+    return IRCMessage(line, raw_tags, prefix, command, params)
+
+def split_frame(frame: str) -> List[str]:
+    """Twitch batches several \\r\\n terminated lines into one websocket frame"""
+    return [line for line in frame.replace("\r", "").split("\n") if line]
+
+def parse_frame(frame: str) -> Iterator[IRCMessage]:
+    for line in split_frame(frame):
+        message = parse_message(line)
+        if message is not None:
+            yield message
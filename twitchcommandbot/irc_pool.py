@@ -0,0 +1,208 @@
+from __future__ import annotations
+import asyncio
+from disnake import Guild
+from .enums import ConnectionState
+from .exceptions import NotConnected, TokenExpired
+from .irc_client import TwitchIRC
+from .user import User
+from time import monotonic
+from typing import TYPE_CHECKING, Dict, List, Optional, Set
+if TYPE_CHECKING:
+    from main import TwitchCommandBot
+
+class GuildIRCClient:
+    """A guild's view of a shared TwitchIRC connection, limited to the channels that guild set up"""
+    def __init__(self, connection: TwitchIRC, guild: Guild):
+        self.connection = connection
+        self.__guild = guild
+
+    @property
+    def user(self) -> User:
+        return self.connection.user
+
+    @property
+    def guild(self) -> Guild:
+        return self.__guild
+
+    @property
+    def oauth(self) -> str:
+        return self.connection.oauth
+
+    @property
+    def closed(self) -> bool:
+        return self.connection.closed
+
+    @property
+    def channels(self) -> List[User]:
+        return self.connection.guild_channels(self.__guild)
+
+    @property
+    def last_activity(self) -> float:
+        return self.connection.last_activity
+
+    @property
+    def stats(self) -> Dict:
+        return self.connection.stats
+
+    async def wait_until_ready(self):
+        await self.connection.wait_until_ready()
+
+    async def join(self, channel: User):
+        await self.connection.join(channel, self.__guild)
+
+    async def part(self, channel: User):
+        await self.connection.part(channel, self.__guild)
+
+    async def send(self, channel: User, message: str, wait: bool = False) -> asyncio.Future:
+        if channel not in self.channels:
+            raise NotConnected(channel)
+        return await self.connection.send(channel, message, wait=wait)
+
+    async def close(self):
+        """Detach this guild, the socket is only closed once no guild is using it"""
+        await self.connection.bot.irc_pool.detach(self.__guild, self.user)
+
+class IRCPool:
+    """IRC connections keyed by twitch user id. Guilds sharing an account share its socket,
+    its token validation and its rate limits, and the socket closes when the last guild detaches.
+    With irc_max_connections set, at most that many sockets are open at once. The least recently used connection
+    is disconnected to make room and comes back by itself the next time it's used, unless its account is pinned"""
+    def __init__(self, bot):
+        self.bot: TwitchCommandBot = bot
+        self.connections: Dict[int, TwitchIRC] = {}
+        self.evictions = 0
+        self.cold_starts = 0
+        self.cold_start_time = 0.0
+        self.max_cold_start = 0.0
+        self._waking: Set[TwitchIRC] = set()
+        self.reload_config(self.bot.auth)
+
+    def reload_config(self, auth: Dict):
+        # A lower cap doesn't disconnect anything by itself, connections over it are evicted as others need a slot
+        self.max_connections: Optional[int] = auth.get("irc_max_connections", None) or None
+        self.pinned: Set[str] = {login.lower() for login in auth.get("irc_pinned_clients", [])}
+        self.slot_timeout = auth.get("irc_slot_timeout", 10)
+
+    @property
+    def open(self) -> List[TwitchIRC]:
+        """Connections with a socket open or on its way"""
+        return [c for c in self.connections.values() if c.state is not ConnectionState.disconnected]
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        attachments = sum(len(c.guilds) for c in self.connections.values())
+        open_connections = len(self.open)
+        return {
+            "connections": len(self.connections),
+            "attachments": attachments,
+            "sockets_saved": attachments - open_connections,
+            "open": open_connections,
+            "max_connections": self.max_connections,
+            "occupancy": open_connections / self.max_connections if self.max_connections else None,
+            "pinned": len(self.pinned),
+            "evictions": self.evictions,
+            "cold_starts": self.cold_starts,
+            "average_cold_start_ms": self.cold_start_time / self.cold_starts * 1000 if self.cold_starts else 0.0,
+            "max_cold_start_ms": self.max_cold_start * 1000
+        }
+
+    def is_pinned(self, connection: TwitchIRC) -> bool:
+        return connection.user.username in self.pinned
+
+    def pin(self, user: User):
+        self.pinned.add(user.username)
+
+    def unpin(self, user: User):
+        self.pinned.discard(user.username)
+
+    def has_room(self, keep: TwitchIRC = None) -> bool:
+        return self.max_connections is None or len([c for c in self.open if c is not keep]) < self.max_connections
+
+    async def make_room(self, keep: TwitchIRC = None) -> bool:
+        """Evict least recently used connections until there's a free slot for keep. Returns False if everything left is
+        pinned or busy"""
+        while not self.has_room(keep):
+            # Connections still connecting, being used or with messages queued are busy, however long ago they were last touched
+            candidates = [c for c in self.open if c is not keep and c.state is ConnectionState.ready
+                          and not self.is_pinned(c) and not c.in_use and not len(c.send_queue)]
+            if not candidates:
+                return False
+            await self.evict(min(candidates, key=lambda c: c.last_activity))
+        return True
+
+    async def evict(self, connection: TwitchIRC, reason: str = "to free up a connection slot"):
+        self.evictions += 1
+        self.bot.log.info(f"{connection.name}: Disconnecting {reason}")
+        await connection.disconnect()
+
+    async def wake(self, connection: TwitchIRC):
+        """Reconnect an evicted connection"""
+        if connection.state is not ConnectionState.disconnected or connection in self._waking \
+                or self.connections.get(connection.user.id, None) is not connection:
+            return
+        started = monotonic()
+        # Anyone else using it meanwhile just waits for ready. It doesn't take up a slot until it actually connects
+        self._waking.add(connection)
+        try:
+            # A burst can find every slot connecting or sending. Those free up quickly, so wait a little for one
+            # before going over the limit
+            while not await self.make_room(connection) and monotonic() - started < self.slot_timeout:
+                await asyncio.sleep(0.05)
+            await connection.connect()
+        finally:
+            self._waking.discard(connection)
+        if connection.state is ConnectionState.ready:
+            elapsed = monotonic() - started
+            self.cold_starts += 1
+            self.cold_start_time += elapsed
+            self.max_cold_start = max(self.max_cold_start, elapsed)
+
+    async def attach(self, guild: Guild, user: User, token: str, channels: List[User]) -> GuildIRCClient:
+        connection = self.connections.get(user.id, None)
+        if connection is None:
+            connection = self.connections[user.id] = TwitchIRC(self.bot, user, token)
+            await connection.attach(guild, channels)
+            # With the pool full this stays disconnected until it's first used. Pinned accounts connect regardless
+            if self.is_pinned(connection):
+                await self.make_room(connection)
+            if self.has_room() or self.is_pinned(connection):
+                try:
+                    await connection.connect()
+                except BaseException:
+                    # Failed or cancelled part way, e.g. by a fan out timing out. The socket and receiver may already be up
+                    await asyncio.shield(connection.close())
+                    raise
+        else:
+            if connection.oauth != f"oauth:{token.split('oauth:')[-1]}":
+                connection.update_token(token)
+            if connection.state is ConnectionState.disconnected:
+                # Joined along with everything else when it connects
+                await connection.attach(guild, channels)
+            elif await connection.wait_until_ready_or_closed():
+                await connection.attach(guild, channels)
+        if self.connections.get(user.id, None) is not connection: # Closed while connecting, the token was rejected
+            raise TokenExpired(user, guild)
+        client = GuildIRCClient(connection, guild)
+        self.bot.irc_clients.setdefault(guild, {})[user.username] = client
+        return client
+
+    async def detach(self, guild: Guild, user: User):
+        guild_clients = self.bot.irc_clients.get(guild, {})
+        guild_clients.pop(user.username, None)
+        if not guild_clients:
+            self.bot.irc_clients.pop(guild, None)
+        connection = self.connections.get(user.id, None)
+        if connection is not None and await connection.detach(guild) == 0:
+            await connection.close()
+
+    def remove(self, connection: TwitchIRC):
+        """Forget a closed connection along with every guild's view of it"""
+        if self.connections.get(connection.user.id, None) is connection:
+            del self.connections[connection.user.id]
+        for guild in connection.guilds:
+            guild_clients = self.bot.irc_clients.get(guild, {})
+            client = guild_clients.get(connection.user.username, None)
+            if client is not None and client.connection is connection:
+                del guild_clients[connection.user.username]
+            if not guild_clients:
+                self.bot.irc_clients.pop(guild, None)
@@ -0,0 +1,65 @@
+from __future__ import annotations
+from disnake import Guild, Member
+from time import perf_counter
+from typing import TYPE_CHECKING, Dict, Set
+if TYPE_CHECKING:
+    from main import TwitchCommandBot
+
+class PermissionResolver:
+    def __init__(self, bot):
+        self.bot: TwitchCommandBot = bot
+        self.owners: Set[int] = set(bot.auth.get("bot_owners", []))
+        self._granted: Dict[int, Set[int]] = {} # Guild id -> granted user ids, filled lazily from storage
+        self.checks = 0
+        self.denied = 0
+        self.check_time = 0.0
+
+    @property
+    def stats(self) -> Dict[str, float]:
+        return {
+            "checks": self.checks,
+            "denied": self.denied,
+            "total_ms": self.check_time * 1000,
+            "average_us": (self.check_time / self.checks * 1000000) if self.checks else 0.0,
+            "cached_guilds": len(self._granted)
+        }
+
+    def reload_owners(self):
+        self.owners = set(self.bot.auth.get("bot_owners", []))
+
+    def invalidate(self, guild_id: int = None):
+        if guild_id is None:
+            self._granted.clear()
+        else:
+            self._granted.pop(guild_id, None)
+
+    async def granted(self, guild_id: int) -> Set[int]:
+        granted = self._granted.get(guild_id, None)
+        if granted is None:
+            granted = self._granted[guild_id] = set(await self.bot.storage.get_permissions(guild_id))
+        return granted
+
+    async def check(self, member: Member, guild: Guild) -> bool:
+        start = perf_counter()
+        try:
+            if member.guild_permissions.administrator or member.id in self.owners:
+                return True
+            if member.id in await self.granted(guild.id):
+                return True
+            self.denied += 1
+            return False
+        finally:
+            self.checks += 1
+            self.check_time += perf_counter() - start
+
+    async def grant(self, guild_id: int, user_id: int) -> bool:
+        try:
+            return await self.bot.storage.grant_permission(guild_id, user_id)
+        finally:
+            self.invalidate(guild_id)
+
+    async def revoke(self, guild_id: int, user_id: int) -> bool:
+        try:
+            return await self.bot.storage.revoke_permission(guild_id, user_id)
+        finally:
+            self.invalidate(guild_id)
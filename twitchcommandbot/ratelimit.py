@@ -0,0 +1,108 @@
+from __future__ import annotations
+import asyncio
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from heapq import heappush, heappop
+from itertools import count
+from time import time, monotonic
+from typing import Dict, List, Mapping, Optional, Tuple
+
+class RequestPriority(IntEnum):
+    interactive = 0
+    background = 1
+
+# Inherited by any tasks spawned while it is set, so a whole startup can be marked as background work
+request_priority: ContextVar[RequestPriority] = ContextVar("request_priority", default=RequestPriority.interactive)
+
+@contextmanager
+def background_priority():
+    token = request_priority.set(RequestPriority.background)
+    try:
+        yield
+    finally:
+        request_priority.reset(token)
+
+class HelixRateLimiter:
+    """Tracks the Helix token bucket from the Ratelimit-* response headers and queues requests
+    once it runs low. Background requests leave the last `reserve` points to interactive ones"""
+    def __init__(self, loop: asyncio.AbstractEventLoop, limit: int = 800, reserve: int = 10):
+        self.loop = loop
+        self.limit = limit
+        self.remaining = limit
+        self.reset_at = 0.0
+        self.reserve = reserve
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = count()
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self.requests = 0
+        self.queued = 0
+        self.wait_time = 0.0
+        self.throttled = 0 # 429 responses
+
+    @property
+    def stats(self) -> Dict[str, float]:
+        return {
+            "limit": self.limit,
+            "remaining": self.remaining,
+            "waiting": len(self._waiters),
+            "requests": self.requests,
+            "queued": self.queued,
+            "average_wait_ms": (self.wait_time / self.queued * 1000) if self.queued else 0.0,
+            "throttled": self.throttled
+        }
+
+    def _available(self, priority: int) -> bool:
+        return self.remaining > (0 if priority == RequestPriority.interactive else self.reserve)
+
+    def _pump(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        if time() >= self.reset_at:
+            # Helix buckets refill over a minute, assume the same until a response says otherwise
+            self.remaining = self.limit
+            self.reset_at = time() + 60
+        while self._waiters:
+            priority, _, future = self._waiters[0]
+            if future.done(): # Cancelled while queued
+                heappop(self._waiters)
+                continue
+            if not self._available(priority):
+                break
+            heappop(self._waiters)
+            self.remaining -= 1
+            future.set_result(None)
+        if self._waiters and self._handle is None:
+            self._handle = self.loop.call_later(max(self.reset_at - time(), 0.05), self._pump)
+
+    async def acquire(self, priority: RequestPriority = None):
+        if priority is None:
+            priority = request_priority.get()
+        self.requests += 1
+        future = self.loop.create_future()
+        heappush(self._waiters, (priority, next(self._seq), future))
+        self._pump()
+        if future.done():
+            return
+        self.queued += 1
+        start = monotonic()
+        try:
+            await future
+        finally:
+            self.wait_time += monotonic() - start
+
+    def throttle(self):
+        """Called on a 429, nothing more goes out until the bucket resets"""
+        self.throttled += 1
+        self.remaining = 0
+        self.reset_at = max(self.reset_at, time() + 1)
+
+    def update(self, headers: Mapping[str, str]):
+        try:
+            self.limit = int(headers["Ratelimit-Limit"])
+            self.remaining = int(headers["Ratelimit-Remaining"])
+            self.reset_at = float(headers["Ratelimit-Reset"])
+        except (KeyError, ValueError):
+            return
+        self._pump()
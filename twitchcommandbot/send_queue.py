@@ -0,0 +1,150 @@
+from __future__ import annotations
+import asyncio
+from collections import deque
+from time import monotonic
+from typing import Awaitable, Callable, Deque, Dict, Optional, Set, Tuple
+
+class TokenBucket:
+    """`capacity` tokens refilled evenly over `per` seconds"""
+    def __init__(self, capacity: int, per: float):
+        self.capacity = capacity
+        self.per = per
+        self.tokens = float(capacity)
+        self.updated = monotonic()
+
+    def _refill(self):
+        now = monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.capacity / self.per)
+        self.updated = now
+
+    def delay(self, count: int = 1) -> float:
+        """Seconds until count tokens are available, 0 if they are available now"""
+        self._refill()
+        if self.tokens >= count:
+            return 0.0
+        return (count - self.tokens) * self.per / self.capacity
+
+    def take(self, count: int = 1):
+        self._refill()
+        self.tokens -= count
+
+Pending = Tuple[str, str, asyncio.Future, float] # channel, line, transmitted future, enqueued at
+
+class SendQueue:
+    """Outbound PRIVMSG queue for one IRC connection.
+    Twitch allows 20 messages per 30 seconds, or 100 in channels the account moderates or owns. Every message
+    counts against the 100 and messages to other channels also count against the 20, so they're queued separately
+    and a backlog of normal messages never holds up moderated channels"""
+    def __init__(self, loop: asyncio.AbstractEventLoop, transmit: Callable[[str], Awaitable],
+                normal_limit: int = 20, moderator_limit: int = 100, per: float = 30):
+        self.loop = loop
+        self.transmit = transmit
+        self.normal_bucket = TokenBucket(normal_limit, per)
+        self.moderator_bucket = TokenBucket(moderator_limit, per)
+        self.moderated: Set[str] = set() # Channel logins where USERSTATE said we're a moderator or the broadcaster
+        self._normal: Deque[Pending] = deque()
+        self._moderated: Deque[Pending] = deque()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.sent = 0
+        self.failed = 0
+        self.delayed = 0 # Messages that had to wait for the bucket
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+    def __len__(self) -> int:
+        return len(self._normal) + len(self._moderated)
+
+    @property
+    def stats(self) -> Dict[str, float]:
+        sent = self.sent + self.failed
+        return {
+            "depth": len(self),
+            "moderated_channels": len(self.moderated),
+            "sent": self.sent,
+            "failed": self.failed,
+            "delayed": self.delayed,
+            "average_wait_ms": (self.wait_time / sent * 1000) if sent else 0.0,
+            "max_wait_ms": self.max_wait * 1000
+        }
+
+    def set_moderator(self, channel: str, moderator: bool):
+        if moderator:
+            self.moderated.add(channel)
+        else:
+            self.moderated.discard(channel)
+
+    def put(self, channel: str, line: str) -> asyncio.Future:
+        """Queue a line for channel. The returned future resolves once it has actually been written to the socket"""
+        future = self.loop.create_future()
+        (self._moderated if channel in self.moderated else self._normal).append((channel, line, future, monotonic()))
+        if self._task is None or self._task.done():
+            self._task = self.loop.create_task(self._drain())
+        self._wakeup.set()
+        return future
+
+    def _next(self) -> Tuple[Optional[Deque[Pending]], float]:
+        """The queue to send from next, or how long until one of them can send"""
+        ready = []
+        wait = None
+        moderator_delay = self.moderator_bucket.delay()
+        for queue, delay in ((self._moderated, moderator_delay), (self._normal, max(moderator_delay, self.normal_bucket.delay()))):
+            if not queue:
+                continue
+            if delay == 0:
+                ready.append(queue)
+            else:
+                wait = delay if wait is None else min(wait, delay)
+        if ready:
+            # Oldest message first when both could go
+            return min(ready, key=lambda q: q[0][3]), 0.0
+        return None, wait or 0.0
+
+    async def _drain(self):
+        while True:
+            if not self:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            queue, wait = self._next()
+            if queue is None:
+                self._wakeup.clear()
+                try:
+                    # A put can only make something ready sooner if it goes to the other queue, so wake up for it
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            channel, line, future, enqueued = queue.popleft()
+            if future.done(): # Cancelled by the caller while queued
+                continue
+            self.moderator_bucket.take()
+            if queue is self._normal:
+                self.normal_bucket.take()
+            waited = monotonic() - enqueued
+            if waited > 0.05:
+                self.delayed += 1
+            self.wait_time += waited
+            self.max_wait = max(self.max_wait, waited)
+            try:
+                await self.transmit(line)
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                self.failed += 1
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                self.sent += 1
+                if not future.done():
+                    future.set_result(None)
+
+    def close(self):
+        """Stop draining and cancel anything still queued"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for queue in (self._normal, self._moderated):
+            while queue:
+                queue.popleft()[2].cancel()
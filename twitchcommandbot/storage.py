@@ -0,0 +1,493 @@
+from __future__ import annotations
+from abc import ABC, abstractmethod
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from .store import JSONStore
+
+ClientData = Dict[str, Any] # {"username": str, "access_token": str, "joined_channels": List[int], "expiry_notified": bool}
+
+class Storage(ABC):
+    """Base class for the bots persistent state. Every backend exposes the same per-row API
+    so callers never need to know how connections, groups or permissions are stored"""
+
+    # Connections
+    @abstractmethod
+    async def get_client(self, guild_id: int, user_id: int) -> Optional[ClientData]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_clients(self, guild_id: int) -> Dict[int, ClientData]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_all_clients(self) -> Dict[int, Dict[int, ClientData]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def add_client(self, guild_id: int, user_id: int, username: str, access_token: str, joined_channels: List[int]):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def remove_client(self, guild_id: int, user_id: int) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def update_client(self, guild_id: int, user_id: int, **fields):
+        """Update the username, access_token or expiry_notified fields of a client"""
+        raise NotImplementedError
+
+    async def update_clients(self, updates: Dict[Tuple[int, int], Dict[str, Any]]):
+        """update_client for many clients at once, keyed by (guild_id, user_id)"""
+        for (guild_id, user_id), fields in updates.items():
+            await self.update_client(guild_id, user_id, **fields)
+
+    @abstractmethod
+    async def add_joined_channel(self, guild_id: int, user_id: int, channel_id: int):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def remove_joined_channel(self, guild_id: int, user_id: int, channel_id: int) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_expiry_channel(self, guild_id: int) -> Optional[int]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def set_expiry_channel(self, guild_id: int, channel_id: int):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def remove_expiry_channel(self, guild_id: int) -> bool:
+        raise NotImplementedError
+
+    # Groups
+    @abstractmethod
+    async def get_groups(self, guild_id: int) -> Dict[str, List[int]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_group(self, guild_id: int, name: str) -> Optional[List[int]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def create_group(self, guild_id: int, name: str) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def delete_group(self, guild_id: int, name: str) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def add_group_member(self, guild_id: int, name: str, user_id: int):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def remove_group_member(self, guild_id: int, name: str, user_id: int) -> bool:
+        raise NotImplementedError
+
+    # Permissions
+    @abstractmethod
+    async def get_permissions(self, guild_id: int) -> List[int]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_all_permissions(self) -> Dict[int, List[int]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def grant_permission(self, guild_id: int, user_id: int) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def revoke_permission(self, guild_id: int, user_id: int) -> bool:
+        raise NotImplementedError
+
+    def reload_changed(self) -> List[str]:
+        """Reload any backing files that were edited outside the bot, returning which parts of the state changed"""
+        return []
+
+    @property
+    def stats(self) -> Dict[str, Dict]:
+        return {}
+
+    async def close(self):
+        pass
+
+
+class JSONStorage(Storage):
+    def __init__(self, loop: asyncio.AbstractEventLoop, connections_path: str = "connections.json", groups_path: str = "groups.json",
+                permissions_path: str = "permissions.json", flush_delay: float = 1.0, journal: bool = False, compact_threshold: int = 1024 * 1024):
+        options = {"flush_delay": flush_delay, "loop": loop, "journal": journal, "compact_threshold": compact_threshold}
+        self.connections = JSONStore(connections_path, **options)
+        self.groups = JSONStore(groups_path, **options)
+        self.permissions = JSONStore(permissions_path, **options)
+
+    @staticmethod
+    def _client(data: Dict[str, Any]) -> ClientData:
+        return {
+            "username": data["username"],
+            "access_token": data["access_token"],
+            "joined_channels": list(data.get("joined_channels", [])),
+            "expiry_notified": data.get("expiry_notified", False)
+        }
+
+    async def get_client(self, guild_id: int, user_id: int) -> Optional[ClientData]:
+        data = self.connections.get((str(guild_id), str(user_id)))
+        return None if data is None else self._client(data)
+
+    async def get_clients(self, guild_id: int) -> Dict[int, ClientData]:
+        return {int(k): self._client(v) for k, v in self.connections.get((str(guild_id),), {}).items() if k != "expiry_channel"}
+
+    async def get_all_clients(self) -> Dict[int, Dict[int, ClientData]]:
+        return {int(g): await self.get_clients(g) for g in self.connections.data.keys()}
+
+    async def add_client(self, guild_id: int, user_id: int, username: str, access_token: str, joined_channels: List[int]):
+        self.connections.set((str(guild_id), str(user_id)), {"username": username, "access_token": access_token, "joined_channels": list(joined_channels)})
+
+    async def remove_client(self, guild_id: int, user_id: int) -> bool:
+        return self.connections.delete((str(guild_id), str(user_id)))
+
+    async def update_client(self, guild_id: int, user_id: int, **fields):
+        # The client may have been removed while this was pending, don't leave a partial record behind
+        if self.connections.get((str(guild_id), str(user_id))) is None:
+            return
+        for key, value in fields.items():
+            # expiry_notified is only written to the file while it is set
+            if key == "expiry_notified" and not value:
+                self.connections.delete((str(guild_id), str(user_id), key))
+            else:
+                self.connections.set((str(guild_id), str(user_id), key), value)
+
+    async def add_joined_channel(self, guild_id: int, user_id: int, channel_id: int):
+        if self.connections.get((str(guild_id), str(user_id))) is None:
+            return
+        self.connections.append((str(guild_id), str(user_id), "joined_channels"), channel_id)
+
+    async def remove_joined_channel(self, guild_id: int, user_id: int, channel_id: int) -> bool:
+        return self.connections.remove((str(guild_id), str(user_id), "joined_channels"), channel_id)
+
+    async def get_expiry_channel(self, guild_id: int) -> Optional[int]:
+        return self.connections.get((str(guild_id), "expiry_channel"))
+
+    async def set_expiry_channel(self, guild_id: int, channel_id: int):
+        # Keep the expiry channel key at the top of the guild
+        self.connections.set((str(guild_id), "expiry_channel"), channel_id, first=True)
+
+    async def remove_expiry_channel(self, guild_id: int) -> bool:
+        return self.connections.delete((str(guild_id), "expiry_channel"))
+
+    async def get_groups(self, guild_id: int) -> Dict[str, List[int]]:
+        return {k: list(v) for k, v in self.groups.get((str(guild_id),), {}).items()}
+
+    async def get_group(self, guild_id: int, name: str) -> Optional[List[int]]:
+        group = self.groups.get((str(guild_id), name))
+        return None if group is None else list(group)
+
+    async def create_group(self, guild_id: int, name: str) -> bool:
+        if self.groups.get((str(guild_id), name)) is not None:
+            return False
+        self.groups.set((str(guild_id), name), [])
+        return True
+
+    async def delete_group(self, guild_id: int, name: str) -> bool:
+        return self.groups.delete((str(guild_id), name))
+
+    async def add_group_member(self, guild_id: int, name: str, user_id: int):
+        if user_id in self.groups.get((str(guild_id), name), []):
+            return
+        self.groups.append((str(guild_id), name), user_id)
+
+    async def remove_group_member(self, guild_id: int, name: str, user_id: int) -> bool:
+        return self.groups.remove((str(guild_id), name), user_id)
+
+    async def get_permissions(self, guild_id: int) -> List[int]:
+        return list(self.permissions.get((str(guild_id),), []))
+
+    async def get_all_permissions(self) -> Dict[int, List[int]]:
+        return {int(k): list(v) for k, v in self.permissions.data.items()}
+
+    async def grant_permission(self, guild_id: int, user_id: int) -> bool:
+        if user_id in self.permissions.get((str(guild_id),), []):
+            return False
+        self.permissions.append((str(guild_id),), user_id)
+        return True
+
+    async def revoke_permission(self, guild_id: int, user_id: int) -> bool:
+        if not self.permissions.remove((str(guild_id),), user_id):
+            return False
+        if self.permissions.get((str(guild_id),)) == []:
+            self.permissions.delete((str(guild_id),))
+        return True
+
+    @property
+    def stats(self) -> Dict[str, Dict]:
+        return {store.path: store.stats for store in (self.connections, self.groups, self.permissions)}
+
+    def reload_changed(self) -> List[str]:
+        changed = []
+        for name, store in (("connections", self.connections), ("groups", self.groups), ("permissions", self.permissions)):
+            if store.changed_on_disk():
+                rejected = store.rejected
+                try:
+                    reloaded = store.reload()
+                except ValueError as e:
+                    # Only warn once per bad version of the file, it's retried every poll until it parses
+                    if store.rejected != rejected:
+                        logging.getLogger("TwitchCommandBot").warning(f"{e}, keeping the current state")
+                    continue
+                if not reloaded:
+                    logging.getLogger("TwitchCommandBot").warning(f"{store.path} was edited on disk, discarding unsaved changes")
+                changed.append(name)
+        return changed
+
+    async def close(self):
+        for store in (self.connections, self.groups, self.permissions):
+            await store.flush()
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS clients (
+    guild_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    username TEXT NOT NULL,
+    access_token TEXT NOT NULL,
+    expiry_notified INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (guild_id, user_id)
+);
+CREATE INDEX IF NOT EXISTS clients_user_id ON clients (user_id);
+CREATE TABLE IF NOT EXISTS joined_channels (
+    guild_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    channel_id INTEGER NOT NULL,
+    PRIMARY KEY (guild_id, user_id, channel_id),
+    FOREIGN KEY (guild_id, user_id) REFERENCES clients (guild_id, user_id) ON DELETE CASCADE
+);
+CREATE TABLE IF NOT EXISTS expiry_channels (
+    guild_id INTEGER PRIMARY KEY,
+    channel_id INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS groups (
+    guild_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    PRIMARY KEY (guild_id, name)
+);
+CREATE TABLE IF NOT EXISTS group_members (
+    guild_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    PRIMARY KEY (guild_id, name, user_id),
+    FOREIGN KEY (guild_id, name) REFERENCES groups (guild_id, name) ON DELETE CASCADE
+);
+CREATE TABLE IF NOT EXISTS permissions (
+    guild_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    PRIMARY KEY (guild_id, user_id)
+);
+"""
+
+class SQLiteStorage(Storage):
+    def __init__(self, loop: asyncio.AbstractEventLoop, path: str = "twitchcommandbot.db"):
+        self.loop = loop
+        self.path = path
+        # sqlite connections aren't safe to share across threads, so every query runs on one worker
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self.created = not os.path.exists(path)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("PRAGMA foreign_keys=ON")
+        self._db.executescript(SCHEMA)
+        self._db.commit()
+
+    async def _run(self, func: Callable, *args) -> Any:
+        return await self.loop.run_in_executor(self._executor, func, *args)
+
+    def _execute(self, query: str, params: tuple = ()) -> int:
+        with self._db:
+            return self._db.execute(query, params).rowcount
+
+    def _fetchall(self, query: str, params: tuple = ()) -> List[tuple]:
+        return self._db.execute(query, params).fetchall()
+
+    def _fetch_clients(self, where: str, params: tuple) -> Dict[int, Dict[int, ClientData]]:
+        clients: Dict[int, Dict[int, ClientData]] = {}
+        for guild_id, user_id, username, access_token, expiry_notified in self._fetchall(
+                f"SELECT guild_id, user_id, username, access_token, expiry_notified FROM clients {where} ORDER BY rowid", params):
+            clients.setdefault(guild_id, {})[user_id] = {"username": username, "access_token": access_token, "joined_channels": [], "expiry_notified": bool(expiry_notified)}
+        for guild_id, user_id, channel_id in self._fetchall(f"SELECT guild_id, user_id, channel_id FROM joined_channels {where} ORDER BY rowid", params):
+            if user_id in clients.get(guild_id, {}):
+                clients[guild_id][user_id]["joined_channels"].append(channel_id)
+        return clients
+
+    async def get_client(self, guild_id: int, user_id: int) -> Optional[ClientData]:
+        clients = await self._run(self._fetch_clients, "WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
+        return clients.get(guild_id, {}).get(user_id, None)
+
+    async def get_clients(self, guild_id: int) -> Dict[int, ClientData]:
+        clients = await self._run(self._fetch_clients, "WHERE guild_id = ?", (guild_id,))
+        return clients.get(guild_id, {})
+
+    async def get_all_clients(self) -> Dict[int, Dict[int, ClientData]]:
+        return await self._run(self._fetch_clients, "", ())
+
+    def _add_client(self, guild_id: int, user_id: int, username: str, access_token: str, joined_channels: List[int]):
+        with self._db:
+            # Re-adding a client starts it over with a fresh channel list
+            self._db.execute("DELETE FROM clients WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
+            self._db.execute("INSERT INTO clients (guild_id, user_id, username, access_token) VALUES (?, ?, ?, ?)",
+                            (guild_id, user_id, username, access_token))
+            self._db.executemany("INSERT OR IGNORE INTO joined_channels (guild_id, user_id, channel_id) VALUES (?, ?, ?)",
+                            [(guild_id, user_id, c) for c in joined_channels])
+
+    async def add_client(self, guild_id: int, user_id: int, username: str, access_token: str, joined_channels: List[int]):
+        await self._run(self._add_client, guild_id, user_id, username, access_token, joined_channels)
+
+    async def remove_client(self, guild_id: int, user_id: int) -> bool:
+        return await self._run(self._execute, "DELETE FROM clients WHERE guild_id = ? AND user_id = ?", (guild_id, user_id)) > 0
+
+    @staticmethod
+    def _update_query(fields: Dict[str, Any]) -> str:
+        for key in fields.keys():
+            if key not in ("username", "access_token", "expiry_notified"):
+                raise KeyError(key)
+        columns = ", ".join(f"{key} = ?" for key in fields.keys())
+        return f"UPDATE clients SET {columns} WHERE guild_id = ? AND user_id = ?"
+
+    async def update_client(self, guild_id: int, user_id: int, **fields):
+        await self._run(self._execute, self._update_query(fields), (*fields.values(), guild_id, user_id))
+
+    def _update_clients(self, updates: Dict[Tuple[int, int], Dict[str, Any]]):
+        with self._db:
+            for (guild_id, user_id), fields in updates.items():
+                self._db.execute(self._update_query(fields), (*fields.values(), guild_id, user_id))
+
+    async def update_clients(self, updates: Dict[Tuple[int, int], Dict[str, Any]]):
+        # One transaction instead of a commit per client
+        await self._run(self._update_clients, updates)
+
+    async def add_joined_channel(self, guild_id: int, user_id: int, channel_id: int):
+        # OR IGNORE doesn't cover foreign keys, a client removed meanwhile is skipped the same as with the JSON backend
+        await self._run(self._execute, "INSERT OR IGNORE INTO joined_channels (guild_id, user_id, channel_id) "
+                        "SELECT ?, ?, ? WHERE EXISTS (SELECT 1 FROM clients WHERE guild_id = ? AND user_id = ?)", (guild_id, user_id, channel_id, guild_id, user_id))
+
+    async def remove_joined_channel(self, guild_id: int, user_id: int, channel_id: int) -> bool:
+        return await self._run(self._execute, "DELETE FROM joined_channels WHERE guild_id = ? AND user_id = ? AND channel_id = ?", (guild_id, user_id, channel_id)) > 0
+
+    async def get_expiry_channel(self, guild_id: int) -> Optional[int]:
+        rows = await self._run(self._fetchall, "SELECT channel_id FROM expiry_channels WHERE guild_id = ?", (guild_id,))
+        return rows[0][0] if rows else None
+
+    async def set_expiry_channel(self, guild_id: int, channel_id: int):
+        await self._run(self._execute, "INSERT OR REPLACE INTO expiry_channels (guild_id, channel_id) VALUES (?, ?)", (guild_id, channel_id))
+
+    async def remove_expiry_channel(self, guild_id: int) -> bool:
+        return await self._run(self._execute, "DELETE FROM expiry_channels WHERE guild_id = ?", (guild_id,)) > 0
+
+    def _get_groups(self, guild_id: int) -> Dict[str, List[int]]:
+        groups = {name: [] for name, in self._fetchall("SELECT name FROM groups WHERE guild_id = ? ORDER BY rowid", (guild_id,))}
+        for name, user_id in self._fetchall("SELECT name, user_id FROM group_members WHERE guild_id = ? ORDER BY rowid", (guild_id,)):
+            groups[name].append(user_id)
+        return groups
+
+    async def get_groups(self, guild_id: int) -> Dict[str, List[int]]:
+        return await self._run(self._get_groups, guild_id)
+
+    def _get_group(self, guild_id: int, name: str) -> Optional[List[int]]:
+        if not self._fetchall("SELECT 1 FROM groups WHERE guild_id = ? AND name = ?", (guild_id, name)):
+            return None
+        return [user_id for user_id, in self._fetchall("SELECT user_id FROM group_members WHERE guild_id = ? AND name = ? ORDER BY rowid", (guild_id, name))]
+
+    async def get_group(self, guild_id: int, name: str) -> Optional[List[int]]:
+        return await self._run(self._get_group, guild_id, name)
+
+    async def create_group(self, guild_id: int, name: str) -> bool:
+        return await self._run(self._execute, "INSERT OR IGNORE INTO groups (guild_id, name) VALUES (?, ?)", (guild_id, name)) > 0
+
+    async def delete_group(self, guild_id: int, name: str) -> bool:
+        return await self._run(self._execute, "DELETE FROM groups WHERE guild_id = ? AND name = ?", (guild_id, name)) > 0
+
+    async def add_group_member(self, guild_id: int, name: str, user_id: int):
+        await self._run(self._execute, "INSERT OR IGNORE INTO group_members (guild_id, name, user_id) VALUES (?, ?, ?)", (guild_id, name, user_id))
+
+    async def remove_group_member(self, guild_id: int, name: str, user_id: int) -> bool:
+        return await self._run(self._execute, "DELETE FROM group_members WHERE guild_id = ? AND name = ? AND user_id = ?", (guild_id, name, user_id)) > 0
+
+    async def get_permissions(self, guild_id: int) -> List[int]:
+        return [user_id for user_id, in await self._run(self._fetchall, "SELECT user_id FROM permissions WHERE guild_id = ? ORDER BY rowid", (guild_id,))]
+
+    def _get_all_permissions(self) -> Dict[int, List[int]]:
+        permissions: Dict[int, List[int]] = {}
+        for guild_id, user_id in self._fetchall("SELECT guild_id, user_id FROM permissions ORDER BY rowid"):
+            permissions.setdefault(guild_id, []).append(user_id)
+        return permissions
+
+    async def get_all_permissions(self) -> Dict[int, List[int]]:
+        return await self._run(self._get_all_permissions)
+
+    async def grant_permission(self, guild_id: int, user_id: int) -> bool:
+        return await self._run(self._execute, "INSERT OR IGNORE INTO permissions (guild_id, user_id) VALUES (?, ?)", (guild_id, user_id)) > 0
+
+    async def revoke_permission(self, guild_id: int, user_id: int) -> bool:
+        return await self._run(self._execute, "DELETE FROM permissions WHERE guild_id = ? AND user_id = ?", (guild_id, user_id)) > 0
+
+    def migrate_from_json(self, connections_path: str = "connections.json", groups_path: str = "groups.json", permissions_path: str = "permissions.json"):
+        """One-shot import of the legacy JSON state files. Runs synchronously, so call it before the bot starts"""
+        def load(path: str) -> Dict[str, Any]:
+            try:
+                with open(path) as f:
+                    return json.load(f)
+            except FileNotFoundError:
+                return {}
+            except json.decoder.JSONDecodeError:
+                return {}
+
+        with self._db:
+            for guild_id, guild_data in load(connections_path).items():
+                for user_id, data in guild_data.items():
+                    if user_id == "expiry_channel":
+                        self._db.execute("INSERT OR REPLACE INTO expiry_channels (guild_id, channel_id) VALUES (?, ?)", (int(guild_id), data))
+                        continue
+                    self._db.execute("INSERT INTO clients (guild_id, user_id, username, access_token, expiry_notified) VALUES (?, ?, ?, ?, ?) "
+                                    "ON CONFLICT (guild_id, user_id) DO UPDATE SET username = excluded.username, access_token = excluded.access_token, expiry_notified = excluded.expiry_notified",
+                                    (int(guild_id), int(user_id), data["username"], data["access_token"], int(data.get("expiry_notified", False))))
+                    self._db.executemany("INSERT OR IGNORE INTO joined_channels (guild_id, user_id, channel_id) VALUES (?, ?, ?)",
+                                    [(int(guild_id), int(user_id), int(c)) for c in data.get("joined_channels", [])])
+            for guild_id, guild_groups in load(groups_path).items():
+                for name, members in guild_groups.items():
+                    self._db.execute("INSERT OR IGNORE INTO groups (guild_id, name) VALUES (?, ?)", (int(guild_id), name))
+                    self._db.executemany("INSERT OR IGNORE INTO group_members (guild_id, name, user_id) VALUES (?, ?, ?)",
+                                    [(int(guild_id), name, int(u)) for u in members])
+            for guild_id, users in load(permissions_path).items():
+                self._db.executemany("INSERT OR IGNORE INTO permissions (guild_id, user_id) VALUES (?, ?)", [(int(guild_id), int(u)) for u in users])
+
+    async def close(self):
+        await self._run(self._db.close)
+        self._executor.shutdown(wait=False)
+
+
+def create_storage(config: Dict[str, Any], loop: asyncio.AbstractEventLoop) -> Storage:
+    backend = config.get("storage", "json")
+    if backend == "json":
+        return JSONStorage(loop, flush_delay=config.get("state_flush_delay", 1.0), journal=config.get("state_journal", False),
+                            compact_threshold=config.get("state_journal_compact_bytes", 1024 * 1024))
+    elif backend == "sqlite":
+        storage = SQLiteStorage(loop, config.get("database_path", "twitchcommandbot.db"))
+        if storage.created: # Bring over any existing JSON state the first time the database is made
+            storage.migrate_from_json()
+        return storage
+    raise ValueError(f"Unknown storage backend \"{backend}\"")
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) < 2:
+        print("Usage: python -m twitchcommandbot.storage <database path>")
+        sys.exit(1)
+    SQLiteStorage(asyncio.new_event_loop(), sys.argv[1]).migrate_from_json()
+    print(f"Migrated JSON state into {sys.argv[1]}")
@@ -0,0 +1,277 @@
+from __future__ import annotations
+import asyncio
+import json
+import os
+from typing import Any, Dict, List, Optional, Sequence
+
+Path = Sequence[str]
+
+class JSONStore:
+    def __init__(self, path: str, flush_delay: float = 1.0, loop: asyncio.AbstractEventLoop = None,
+                journal: bool = False, compact_threshold: int = 1024 * 1024):
+        self.path = path
+        self.journal_path = f"{path}.journal"
+        self.flush_delay = flush_delay
+        self.loop = loop or asyncio.get_event_loop()
+        # In journal mode every mutation is appended as a small record instead of rewriting the whole file.
+        # The journal is folded back into the snapshot once it grows past compact_threshold bytes
+        self.journal = journal
+        self.compact_threshold = compact_threshold
+        self.hits = 0 # Reads served from memory
+        self.mutations = 0
+        self.flushes = 0
+        self.compactions = 0
+        self.journal_bytes = 0
+        self._records: List[str] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._flush_lock = asyncio.Lock()
+        self._dirty = False
+        self.signature = self._signature()
+        self.rejected: Optional[tuple] = None # Signature of the last version of the file that failed to parse
+        self._data: Dict[str, Any] = self._load()
+        if self.journal:
+            self._replay()
+
+    def _signature(self) -> Optional[tuple]:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_ino, st.st_size)
+
+    def changed_on_disk(self) -> bool:
+        return self._signature() != self.signature
+
+    def reload(self) -> bool:
+        """Reload the file after it was edited by hand. Returns False if unsaved changes were discarded.
+        Raises ValueError and keeps the current state if the file isn't valid JSON, e.g. half way through being saved"""
+        signature = self._signature()
+        try:
+            data = self._read()
+        except json.decoder.JSONDecodeError as e:
+            # The signature is left alone so the next poll tries again
+            self.rejected = signature
+            raise ValueError(f"{self.path} is not valid JSON") from e
+        self.rejected = None
+        discarded = self._dirty
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        self._dirty = False
+        self._records = []
+        self.signature = signature
+        self._data = data
+        if self.journal:
+            # The edited snapshot is the source of truth now. Replaying records from before the edit over it would
+            # bring back whatever was removed by hand, as partial records at that
+            self._discard_journal()
+        return not discarded
+
+    def _read(self) -> Dict[str, Any]:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _load(self) -> Dict[str, Any]:
+        try:
+            return self._read()
+        except json.decoder.JSONDecodeError:
+            return {}
+
+    def _discard_journal(self):
+        try:
+            os.truncate(self.journal_path, 0)
+        except FileNotFoundError:
+            pass
+        self.journal_bytes = 0
+
+    def _replay(self):
+        try:
+            with open(self.journal_path, "rb") as f:
+                good = 0 # Offset just past the last complete record
+                for line in f:
+                    try:
+                        record = json.loads(line) if line.endswith(b"\n") else None
+                    except json.decoder.JSONDecodeError:
+                        record = None
+                    if record is None:
+                        break # Torn write from a crash, nothing after it made it to disk either
+                    self._apply(record)
+                    good += len(line)
+            if good < os.path.getsize(self.journal_path):
+                # Cut the torn record off, otherwise the next append lands on the end of it and is lost on the next replay
+                os.truncate(self.journal_path, good)
+            self.journal_bytes = good
+        except FileNotFoundError:
+            pass
+
+    def _apply(self, record: Dict[str, Any]):
+        op = record["op"]
+        if op == "set":
+            self._set(record["path"], record["value"], record.get("first", False))
+        elif op == "del":
+            self._delete(record["path"], record.get("prune", True))
+        elif op == "append":
+            items = self._parent(record["path"], create=True).setdefault(record["path"][-1], [])
+            if record["value"] not in items:
+                items.append(record["value"])
+        elif op == "remove":
+            items = self.get(record["path"], [])
+            if record["value"] in items:
+                items.remove(record["value"])
+
+    @property
+    def data(self) -> Dict[str, Any]:
+        self.hits += 1
+        return self._data
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "mutations": self.mutations,
+            "flushes": self.flushes,
+            "compactions": self.compactions,
+            "journal_bytes": self.journal_bytes,
+            "pending": int(self._dirty)
+        }
+
+    def get(self, path: Path, default: Any = None) -> Any:
+        self.hits += 1
+        node = self._data
+        for key in path:
+            if not isinstance(node, dict) or key not in node:
+                return default
+            node = node[key]
+        return node
+
+    def _parent(self, path: Path, create: bool) -> Optional[Dict[str, Any]]:
+        node = self._data
+        for key in path[:-1]:
+            if key not in node:
+                if not create:
+                    return None
+                node[key] = {}
+            node = node[key]
+        return node
+
+    def _set(self, path: Path, value: Any, first: bool = False):
+        parent = self._parent(path, create=True)
+        if first and next(iter(parent), path[-1]) != path[-1]:
+            # Rebuilt in place so the key ends up at the top when the file is written
+            rest = [(k, v) for k, v in parent.items() if k != path[-1]]
+            parent.clear()
+            parent[path[-1]] = value
+            parent.update(rest)
+        else:
+            parent[path[-1]] = value
+
+    def _delete(self, path: Path, prune: bool) -> bool:
+        parent = self._parent(path, create=False)
+        if parent is None or path[-1] not in parent:
+            return False
+        del parent[path[-1]]
+        if prune:
+            for i in range(len(path) - 1, 0, -1):
+                node = self._parent(path[:i], create=False)
+                if node is None or node.get(path[i-1]) != {}:
+                    break
+                del node[path[i-1]]
+        return True
+
+    def _record(self, op: str, path: Path, **fields):
+        if self.journal:
+            # Serialised straight away so later in-place changes can't leak into this record
+            self._records.append(json.dumps({"op": op, "path": list(path), **fields}, separators=(",", ":")) + "\n")
+
+    def set(self, path: Path, value: Any, first: bool = False):
+        """Set the key at path, moving it to the top of its parent dict when first is set"""
+        self._set(path, value, first)
+        if first:
+            self._record("set", path, value=value, first=True)
+        else:
+            self._record("set", path, value=value)
+        self.save()
+
+    def delete(self, path: Path, prune: bool = True) -> bool:
+        """Delete the key at path. Empty parent dicts are removed along with it when prune is set"""
+        if not self._delete(path, prune):
+            return False
+        self._record("del", path, prune=prune)
+        self.save()
+        return True
+
+    def append(self, path: Path, value: Any) -> bool:
+        """Add value to the list at path. The lists in the state are sets of ids, so it's skipped if already there"""
+        items = self._parent(path, create=True).setdefault(path[-1], [])
+        if value in items:
+            return False
+        items.append(value)
+        # Only the element is journaled, replaying it twice is still harmless since it won't be added again
+        self._record("append", path, value=value)
+        self.save()
+        return True
+
+    def remove(self, path: Path, value: Any) -> bool:
+        items: List[Any] = self.get(path, [])
+        if value not in items:
+            return False
+        items.remove(value)
+        self._record("remove", path, value=value)
+        self.save()
+        return True
+
+    def save(self):
+        # Debounce writes, a burst of mutations only costs a single flush
+        self.mutations += 1
+        self._dirty = True
+        if self._flush_handle is None:
+            self._flush_handle = self.loop.call_later(self.flush_delay, lambda: self.loop.create_task(self.flush()))
+
+    def _write(self, payload: str):
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self.signature = self._signature()
+
+    def _append_journal(self, records: List[str]) -> int:
+        with open(self.journal_path, "a") as f:
+            f.write("".join(records))
+            f.flush()
+            os.fsync(f.fileno())
+            return f.tell()
+
+    def _compact(self, payload: str):
+        # Snapshot first, then drop the journal. Records are idempotent so a crash in between only replays them again
+        self._write(payload)
+        with open(self.journal_path, "w") as f:
+            os.fsync(f.fileno())
+
+    async def flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            if self.journal:
+                records, self._records = self._records, []
+                self.journal_bytes = await self.loop.run_in_executor(None, self._append_journal, records)
+                if self.journal_bytes >= self.compact_threshold:
+                    await self.compact()
+            else:
+                payload = json.dumps(self._data, indent=4)
+                await self.loop.run_in_executor(None, self._write, payload)
+            self.flushes += 1
+
+    async def compact(self):
+        payload = json.dumps(self._data, indent=4)
+        await self.loop.run_in_executor(None, self._compact, payload)
+        self.journal_bytes = 0
+        self.compactions += 1
@@ -1,30 +1,141 @@
+from __future__ import annotations
+from disnake import Guild
 from disnake.ext import tasks, commands
-from datetime import time, datetime
 import asyncio
-from typing import TYPE_CHECKING
+from math import ceil
+from time import monotonic
+from traceback import format_exception
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+from .exceptions import NotFound, TokenExpired
 if TYPE_CHECKING:
     from main import TwitchCommandBot
+    from twitchcommandbot import TwitchIRC
 
 class TokenMaintainer(commands.Cog):
+    """Revalidates tokens a few connections at a time so the whole pool is covered every token_sweep_period hours.
+    Only connections whose token has actually stopped working are closed, everything else keeps its socket"""
     def __init__(self, bot):
         self.bot: TwitchCommandBot = bot
-        self.index = 0
+        self.index = 0 # User id the sweep got up to, closing connections can't make it skip any that way
+        self.interval = self.bot.auth.get("token_sweep_interval", 10) # Minutes between batches
+        self.period = self.bot.auth.get("token_sweep_period", 24) # Hours to get through every connection
+        self.last_sweep: Optional[Dict] = None
+        self.checked = 0
+        self.expired = 0
+        self.passes = 0
+        self.maintainer.change_interval(minutes=self.interval)
         self.maintainer.start()
-        #self.bot.loop.create_task(self.maintainer())
 
     def cog_unload(self):
         self.maintainer.cancel()
 
-    @tasks.loop(time=time(hour=0))
+    @commands.Cog.listener()
+    async def on_config_reload(self, auth: Dict):
+        interval = auth.get("token_sweep_interval", 10)
+        self.period = auth.get("token_sweep_period", 24)
+        if interval != self.interval:
+            self.interval = interval
+            self.maintainer.change_interval(minutes=self.interval)
+
+    @property
+    def stats(self) -> Dict:
+        return {
+            "last_sweep": self.last_sweep,
+            "checked": self.checked,
+            "expired": self.expired,
+            "passes": self.passes
+        }
+
+    @tasks.loop(minutes=10)
     async def maintainer(self):
         await self.bot.wait_until_ready()
-        self.bot.log.info("Restarting clients")
-        for d in dict(self.bot.irc_clients).values():
-            for client in list(d.values()):
-                if not client.closed:
-                    await client.close()
-        await asyncio.sleep(2)
-        await self.bot.start_all_clients()
+        connections = sorted(self.bot.irc_pool.connections.values(), key=lambda c: c.user.id)
+        if not connections:
+            return
+        size = max(ceil(len(connections) * self.interval / (self.period * 60)), 1)
+        pending = [c for c in connections if c.user.id > self.index]
+        batch = pending[:size]
+        self.index = batch[-1].user.id if batch else 0
+        started = monotonic()
+        results = await asyncio.gather(*[self.check(connection) for connection in batch], return_exceptions=True)
+        expired = sum(r is False for r in results)
+        for error in [r for r in results if isinstance(r, Exception)]:
+            self.bot.log.warning(f"Token sweep failed to check a client: {error!r}")
+        self.checked += len(batch)
+        self.expired += expired
+        self.last_sweep = {"checked": len(batch), "expired": expired, "duration": monotonic() - started}
+        if expired:
+            self.bot.log.info(f"Token sweep closed {expired} of {len(batch)} client{'s' if len(batch) != 1 else ''}")
+        if len(pending) <= size:
+            self.index = 0
+            self.passes += 1
+            # Once a full pass, pick up anything that failed to start since
+            try:
+                await self.retry()
+            except Exception as e:
+                # An uncaught error would stop the loop, and with it every later sweep
+                self.bot.log.error(f"Token sweep failed to start clients:\n{''.join(format_exception(type(e), e, e.__traceback__))}")
+
+    async def retry(self):
+        """Start clients that aren't running, e.g. because Twitch couldn't be reached when they were first started.
+        Clients already known to have an expired token are left alone until the token is updated, which starts them anyway"""
+        pending: List[Tuple[Guild, int]] = []
+        for guild_id, guild_clients in (await self.bot.storage.get_all_clients()).items():
+            guild = self.bot.get_guild(guild_id)
+            if guild is None:
+                continue
+            running = self.bot.irc_clients.get(guild, {})
+            pending.extend((guild, user_id) for user_id, data in guild_clients.items()
+                           if data["username"] not in running and not data["expiry_notified"])
+        if not pending:
+            return
+        started = 0
+        with self.bot.api.background():
+            users = {user.id: user for user in await self.bot.api.get_users(user_ids=list({user_id for _, user_id in pending}))}
+            for guild, user_id in pending:
+                user = users.get(user_id, None)
+                if user is None:
+                    continue
+                try:
+                    await self.bot.get_irc_client(guild, user)
+                    started += 1
+                except TokenExpired:
+                    await self.bot.storage.update_client(guild.id, user.id, expiry_notified=True)
+                    await self.bot.notify_expired(guild, user)
+                    self.bot.log.warning(f"{guild.name} ({user.username}): Not starting client due to expired token")
+                except (commands.UserNotFound, NotFound):
+                    pass # Removed while this was running
+                except Exception as e:
+                    self.bot.log.warning(f"{guild.name} ({user.username}): Failed to start client: {e!r}")
+        if started:
+            self.bot.log.info(f"Token sweep started {started} client{'s' if started != 1 else ''}")
+
+    async def check(self, connection: TwitchIRC) -> bool:
+        """Returns False if the connection was closed because none of its tokens work anymore"""
+        if await self.validate(connection, connection.oauth) != False:
+            return True
+        # A guild may have stored a newer token for the same account since it connected
+        tokens: List[str] = []
+        for guild in connection.guilds:
+            data = await self.bot.storage.get_client(guild.id, connection.user.id)
+            if data is None:
+                continue
+            token = f"oauth:{data['access_token'].split('oauth:')[-1]}"
+            if token != connection.oauth and token not in tokens:
+                tokens.append(token)
+        for token in tokens:
+            if await self.validate(connection, token) == True:
+                connection.update_token(token)
+                return True
+        self.bot.log.warning(f"{connection.name}: Token no longer valid, closing")
+        await connection.handle_revoked_token()
+        await connection.close()
+        return False
+
+    async def validate(self, connection: TwitchIRC, token: str) -> Optional[bool]:
+        # The cached result could be up to an hour old, the point here is to ask Twitch again
+        self.bot.api.invalidate_token(token)
+        return await self.bot.api.validate_token(connection.user, token, required_scopes=["chat:read", "chat:edit"])
 
 def setup(bot):
-    bot.add_cog(TokenMaintainer(bot))
\ No newline at end of file
+    bot.add_cog(TokenMaintainer(bot))
@@ -0,0 +1,136 @@
+from abc import ABC, abstractmethod
+import asyncio
+import ssl
+from typing import Any, Dict, Optional
+from websockets import client
+from websockets.exceptions import ConnectionClosed, InvalidHandshake, InvalidURI
+
+class TransportClosed(ConnectionError):
+    """The connection went away, raised by send and recv"""
+    pass
+
+class Transport(ABC):
+    """One IRC connection to Twitch. recv returns one or more complete \\r\\n terminated lines"""
+    @abstractmethod
+    async def connect(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def send(self, data: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def recv(self) -> str:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def close(self):
+        raise NotImplementedError
+
+    @property
+    @abstractmethod
+    def closed(self) -> bool:
+        raise NotImplementedError
+
+class WebSocketTransport(Transport):
+    def __init__(self, url: str = "wss://irc-ws.chat.twitch.tv:443", ssl_context: ssl.SSLContext = None):
+        self.url = url
+        self.ssl_context = ssl_context
+        self._socket = None
+
+    async def connect(self):
+        options = {"ssl": self.ssl_context} if self.ssl_context is not None else {}
+        try:
+            self._socket = await client.connect(self.url, **options)
+        except (InvalidHandshake, InvalidURI) as e:
+            raise ConnectionError(f"Websocket handshake failed: {e}") from e
+
+    async def send(self, data: str):
+        try:
+            await self._socket.send(data)
+        except ConnectionClosed as e:
+            raise TransportClosed(str(e)) from e
+
+    async def recv(self) -> str:
+        try:
+            return await self._socket.recv()
+        except ConnectionClosed as e:
+            raise TransportClosed(str(e)) from e
+
+    async def close(self):
+        if self._socket is not None:
+            await self._socket.close()
+
+    @property
+    def closed(self) -> bool:
+        return self._socket is None or self._socket.closed
+
+class StreamTransport(Transport):
+    """Plain IRC over TCP, TLS by default. No websocket framing, masking or compression on every line"""
+    read_size = 65536
+
+    def __init__(self, host: str = "irc.chat.twitch.tv", port: int = 6697, tls: bool = True, ssl_context: ssl.SSLContext = None):
+        self.host = host
+        self.port = port
+        self.ssl_context = (ssl_context or ssl.create_default_context()) if tls else None
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._buffer = b""
+        self._closed = False
+
+    async def connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl_context,
+                                                                   server_hostname=self.host if self.ssl_context else None)
+
+    async def send(self, data: str):
+        if self.closed:
+            raise TransportClosed("Connection closed")
+        self._writer.write(data.encode())
+        try:
+            await self._writer.drain()
+        except (OSError, ssl.SSLError, asyncio.TimeoutError) as e: # Resets, TLS failures and timeouts all mean the socket is gone
+            self._closed = True
+            raise TransportClosed(repr(e)) from e
+
+    async def recv(self) -> str:
+        # Hand back everything up to the last complete line, whatever's after it waits for the next read
+        while True:
+            try:
+                chunk = await self._reader.read(self.read_size)
+            except (OSError, ssl.SSLError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                self._closed = True
+                raise TransportClosed(repr(e)) from e
+            if not chunk:
+                self._closed = True
+                raise TransportClosed("Connection closed by the server")
+            end = chunk.rfind(b"\n")
+            if end == -1:
+                self._buffer += chunk
+                continue
+            data = self._buffer + chunk[:end + 1]
+            self._buffer = chunk[end + 1:]
+            return data.decode(errors="replace")
+
+    async def close(self):
+        self._closed = True
+        if self._writer is None:
+            return
+        if not self._writer.is_closing():
+            self._writer.close()
+        try:
+            # The TLS close_notify exchange can hang on a dead peer
+            await asyncio.wait_for(self._writer.wait_closed(), timeout=5)
+        except (ConnectionError, ssl.SSLError, asyncio.TimeoutError):
+            pass
+
+    @property
+    def closed(self) -> bool:
+        return self._closed or self._writer is None or self._writer.is_closing()
+
+def create_transport(config: Dict[str, Any]) -> Transport:
+    kind = config.get("irc_transport", "websocket")
+    if kind == "websocket":
+        return WebSocketTransport(config.get("irc_websocket_url", "wss://irc-ws.chat.twitch.tv:443"))
+    elif kind == "tcp":
+        return StreamTransport(config.get("irc_host", "irc.chat.twitch.tv"), config.get("irc_port", 6697), tls=config.get("irc_tls", True))
+    raise ValueError(f"Unknown IRC transport \"{kind}\"")
@@ -4,35 +4,99 @@ from .enums import UserType, BroadcasterType
 from datetime import datetime
 from typing import Optional
 
+_MISSING = object()
+
 class PartialUser:
+    __slots__ = ("id", "login", "display_name")
+
     def __init__(self, user_id, user_login, display_name):
-        self.user_id: int = int(user_id)
         self.id: int = int(user_id)
         self.login: str = user_login
-        self.name: str = user_login
-        self.username: str = user_login
         self.display_name: str = display_name
 
+    # Aliases kept for the existing attribute API
+    @property
+    def user_id(self) -> int:
+        return self.id
+
+    @property
+    def name(self) -> str:
+        return self.login
+
+    @property
+    def username(self) -> str:
+        return self.login
+
     def __str__(self) -> str:
         return self.login
-        
+
     def __repr__(self) -> str:
         return f'<User id={self.id} name={self.name!r}>'
 
     def __eq__(self, other):
-        return isinstance(other, User) and self.id == other.id
+        return isinstance(other, PartialUser) and self.id == other.id
+
+    def __hash__(self) -> int:
+        return hash(self.id)
 
 
 class User(PartialUser):
+    __slots__ = ("_type", "_broadcaster_type", "_description", "_profile_image_url", "_offline_image_url", "_view_count", "_created_at",
+                "_avatar", "_offline_image", "_created_at_parsed")
+
     def __init__(self, id: int, login: str, display_name: str, type: UserType, broadcaster_type: BroadcasterType,
                 description: str, profile_image_url: str, offline_image_url: str, view_count: int, created_at: datetime):
         super().__init__(id, login, display_name)
-        self.user_type: UserType = UserType(type)
-        self.type: UserType = UserType(type)
-        self.broadcaster_type: BroadcasterType = BroadcasterType(broadcaster_type)
-        self.user_description: Optional[str] = None if description == "" else description
-        self.description = None if description == "" else description
-        self.avatar: Optional[Avatar] = None if profile_image_url == "" else Avatar(profile_image_url)
-        self.offline_image: Optional[OfflineImage] = None if offline_image_url == "" else OfflineImage(offline_image_url)
-        self.view_count: int = int(view_count)
-        self.created_at: datetime = parser.parse(created_at)
+        # The rest is kept raw and only parsed on first access, most lookups never go past the id and login
+        self._type = type
+        self._broadcaster_type = broadcaster_type
+        self._description = description
+        self._profile_image_url = profile_image_url
+        self._offline_image_url = offline_image_url
+        self._view_count = view_count
+        self._created_at = created_at
+        self._avatar = _MISSING
+        self._offline_image = _MISSING
+        self._created_at_parsed = _MISSING
+
+    @property
+    def user_type(self) -> UserType:
+        return UserType(self._type)
+
+    @property
+    def type(self) -> UserType:
+        return self.user_type
+
+    @property
+    def broadcaster_type(self) -> BroadcasterType:
+        return BroadcasterType(self._broadcaster_type)
+
+    @property
+    def user_description(self) -> Optional[str]:
+        return None if self._description == "" else self._description
+
+    @property
+    def description(self) -> Optional[str]:
+        return self.user_description
+
+    @property
+    def avatar(self) -> Optional[Avatar]:
+        if self._avatar is _MISSING:
+            self._avatar = None if self._profile_image_url == "" else Avatar(self._profile_image_url)
+        return self._avatar
+
+    @property
+    def offline_image(self) -> Optional[OfflineImage]:
+        if self._offline_image is _MISSING:
+            self._offline_image = None if self._offline_image_url == "" else OfflineImage(self._offline_image_url)
+        return self._offline_image
+
+    @property
+    def view_count(self) -> int:
+        return int(self._view_count)
+
+    @property
+    def created_at(self) -> datetime:
+        if self._created_at_parsed is _MISSING:
+            self._created_at_parsed = parser.parse(self._created_at)
+        return self._created_at_parsed
@@ -0,0 +1,101 @@
+from collections import OrderedDict
+from time import monotonic
+from typing import Dict, Optional, Tuple
+from .user import User
+
+class UserCache:
+    def __init__(self, ttl: float = 300, max_size: int = 5000, negative_ttl: float = 60):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.negative_ttl = negative_ttl
+        self._users: OrderedDict[int, Tuple[float, User]] = OrderedDict() # id -> (expiry, user), oldest first
+        self._logins: Dict[str, int] = {}
+        self._missing: Dict[str, float] = {} # Logins Helix said don't exist -> expiry
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    @property
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses + self.negative_hits
+        return {
+            "size": len(self._users),
+            "missing": len(self._missing),
+            "hits": self.hits,
+            "misses": self.misses,
+            "negative_hits": self.negative_hits,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits + self.negative_hits) / lookups if lookups else 0.0
+        }
+
+    def get_by_id(self, user_id: int) -> Optional[User]:
+        entry = self._users.get(int(user_id), None)
+        if entry is None or entry[0] < monotonic():
+            if entry is not None:
+                self.invalidate(user_id=int(user_id))
+            self.misses += 1
+            return None
+        self._users.move_to_end(int(user_id))
+        self.hits += 1
+        return entry[1]
+
+    def get_by_login(self, login: str) -> Optional[User]:
+        user_id = self._logins.get(login.lower(), None)
+        if user_id is None:
+            self.misses += 1
+            return None
+        user = self.get_by_id(user_id)
+        if user is not None and user.login != login.lower():
+            # The id has since been seen under a new name
+            self._logins.pop(login.lower(), None)
+            self.hits -= 1
+            self.misses += 1
+            return None
+        return user
+
+    def is_missing(self, login: str) -> bool:
+        expiry = self._missing.get(login.lower(), None)
+        if expiry is None:
+            return False
+        if expiry < monotonic():
+            del self._missing[login.lower()]
+            return False
+        self.negative_hits += 1
+        return True
+
+    def put(self, user: User):
+        old = self._users.pop(user.id, None)
+        if old is not None and old[1].login != user.login:
+            self._logins.pop(old[1].login, None)
+        self._users[user.id] = (monotonic() + self.ttl, user)
+        self._logins[user.login] = user.id
+        self._missing.pop(user.login, None)
+        while len(self._users) > self.max_size:
+            _, (_, evicted) = self._users.popitem(last=False)
+            if self._logins.get(evicted.login, None) == evicted.id:
+                del self._logins[evicted.login]
+            self.evictions += 1
+
+    def put_missing(self, login: str):
+        self._missing[login.lower()] = monotonic() + self.negative_ttl
+        if len(self._missing) > self.max_size:
+            now = monotonic()
+            self._missing = {k: v for k, v in self._missing.items() if v >= now}
+
+    def invalidate(self, user_id: int = None, login: str = None):
+        if user_id is not None:
+            entry = self._users.pop(int(user_id), None)
+            if entry is not None and self._logins.get(entry[1].login, None) == entry[1].id:
+                del self._logins[entry[1].login]
+        if login is not None:
+            self._logins.pop(login.lower(), None)
+            self._missing.pop(login.lower(), None)
+
+    def clear(self):
+        self._users.clear()
+        self._logins.clear()
+        self._missing.clear()
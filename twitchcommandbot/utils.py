@@ -0,0 +1,12 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def json_loads(data):
+    """Decode JSON with orjson when it's installed, falling back to the standard library"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)